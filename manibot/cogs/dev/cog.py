@@ -119,11 +119,11 @@ class Dev:
         await ctx.codeblock(p.stdout.read().decode("utf-8"), syntax="")
 
     @command(aliases=['exc'])
-    async def last_exception(self, ctx, count=1):
+    async def last_exception(self, ctx, count=1, page=None):
         table = ctx.bot.dbi.table('bot_logs')
-        query = table.query.order_by('created', asc=False)
-        query.where(level_name='ERROR').limit(count)
-        results = await query.get()
+        query = table.query.order_by('created', 'log_id', asc=False)
+        query.where(level_name='ERROR')
+        results, token = await query.get_page(count, after=page)
         output = []
         for rcrd in results:
             details = []
@@ -135,4 +135,6 @@ class Dev:
             output.append(" | ".join(details))
             output.append(rcrd['traceback'])
             output.append('-'*40)
+        if token:
+            output.append(f"Older: {ctx.prefix}exc {count} {token}")
         await ctx.codeblock('\n'.join(output))
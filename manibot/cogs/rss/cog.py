@@ -1,29 +1,37 @@
 import asyncio
+import functools
+import hashlib
 import logging
+import time
 import urllib
 import traceback
 from dateutil.parser import parse
 
 import aiohttp
-import bs4
-import feedparser
-
 import discord
 from discord import AsyncWebhookAdapter, Embed, Webhook
 
 from manibot import Cog, checks, command, group
+from manibot.core.data_manager import errors
 from manibot.utils.formatters import unescape_html
 from manibot.utils.datatypes import Map
+from manibot.utils import parsing
+
+from .delivery import MAX_EMBEDS, WebhookDelivery
+from .scheduler import AdaptiveScheduler
 
 HATIGARMRSS = "https://hatigarmscanz.net/feed"
 
+# returned by a conditional feed fetch when nothing has changed
+FEED_UNCHANGED = b''
+
 logger = logging.getLogger('manibot.rss')
 
 
 class RSSEntry:
 
     __slots__ = ('bot', 'dbi', 'data', 'title', 'link', 'author',
-                 'summary', 'item_id', 'updated', '_content')
+                 'summary', 'item_id', 'updated', '_poster_url')
 
     def __init__(self, bot, data):
         self.bot = bot
@@ -43,7 +51,7 @@ class RSSEntry:
         else:
             self.updated = data.updated
 
-        self._content = None
+        self._poster_url = None
 
     @property
     def data_table(self):
@@ -51,18 +59,20 @@ class RSSEntry:
 
     @property
     def query(self):
-        return self.data_table.query.where(item_id=self.item_id)
+        # checked right after inserts, so can't wait on a replica
+        query = self.data_table.query.use_primary()
+        return query.where(item_id=self.item_id)
 
-    async def content(self, fresh=False):
-        if not fresh and self._content:
-            return self._content
-
-        async with self.bot.session.get(self.item_id) as r:
-            if r.status != 200:
-                return False
-            content = await r.text()
-            self._content = bs4.BeautifulSoup(content, 'html.parser')
-        return self._content
+    async def content(self):
+        # a page that can't be fetched only costs the embed its thumbnail
+        try:
+            async with self.bot.session.get(self.item_id) as r:
+                if r.status != 200:
+                    return False
+                return await r.text()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.error(f'{type(e)} - Exception: {e}')
+            return None
 
     async def exists(self):
         value = await self.query.get_value('item_id')
@@ -71,11 +81,15 @@ class RSSEntry:
     async def get(self):
         return await self.query.get()
 
-    async def insert(self):
-        insert = self.data_table.insert(
+    @property
+    def row(self):
+        return dict(
             item_id=self.item_id, title=self.title, link=self.link,
             updated=self.updated, author=self.author, summary=self.summary
         )
+
+    async def insert(self):
+        insert = self.data_table.insert(**self.row)
         await insert.commit()
 
     async def series_title(self):
@@ -107,10 +121,14 @@ class RSSEntry:
         except Exception as e:
             logger.error(f'Exception {type(e)}: {e}')
 
-    async def poster_url(self):
+    async def poster_url(self, fresh=False):
+        if not fresh and self._poster_url:
+            return self._poster_url
         content = await self.content()
-        image = content.find("meta", property="og:image")
-        return image["content"] if image else None
+        if not content:
+            return None
+        self._poster_url = await self.bot.parser.run(parsing.og_image, content)
+        return self._poster_url
 
     async def embed_data(self):
         poster = await self.poster_url()
@@ -142,57 +160,15 @@ class RSSEntry:
             return await self.bot.series.get_series_role(guild_id, series_title)
         return None
 
-    async def get_mention(self, guild_id):
-        role = await self.get_role(guild_id)
+    @property
+    def series_name(self):
+        return self.title.rsplit('#', 1)[0].strip()
+
+    async def get_mention(self, guild_id, role=None):
+        role = role or await self.get_role(guild_id)
         if role:
             return role.mention
-        title = self.title.rsplit('#', 1)[0].strip()
-        return f"@{title} (New?)"
-
-    async def send_to_webhook(self, webhook, do_ping=True):
-        if do_ping:
-            pings = await self.get_mention(webhook.guild_id)
-            if webhook.sub_role_id:
-                pings = f"<@&{webhook.sub_role_id}> {pings}"
-        else:
-            pings = ""
-
-        # await self.wait_until_published()
-
-        roles = list()
-        if do_ping:
-            s_role = await self.get_role(webhook.guild_id)
-            if s_role:
-                roles.append(s_role)
-
-            if webhook.sub_role_id:
-                guild = self.bot.get_guild(webhook.guild_id)
-                n_role = discord.utils.get(guild.roles, id=webhook.sub_role_id)
-                if n_role:
-                    roles.append(n_role)
-
-            if roles:
-                logger.info(f"Unlocking notification roles - {self.item_id}")
-                for role in roles:
-                    try:
-                        await role.edit(mentionable=True)
-                    except discord.Forbidden:
-                        pass
-
-                await asyncio.sleep(5)
-
-        logger.info(f"Pushing Update - {self.item_id}")
-        embed = await self.embed()
-        await webhook.webhook.send(pings, embed=embed, avatar_url=webhook.avatar)
-
-        if do_ping and roles:
-            await asyncio.sleep(5)
-            logger.info(f"Reverting series role to unmentionable - {self.item_id}")
-            for role in roles:
-                try:
-                    await role.edit(mentionable=False)
-                except discord.Forbidden:
-                    pass
+        return f"@{self.series_name} (New?)"
 
     async def send_to_channel(self, channel):
         embed = await self.embed()
@@ -216,14 +192,8 @@ class RSSEntry:
                 if r.status != 200:
                     return False
                 content = await r.text()
-                soup = bs4.BeautifulSoup(content, 'html.parser')
-                allimgs = soup.find("div", {"id": "all"})
-                if not allimgs:
-                    return False
-                firstimg = allimgs.find("img")
-                if not firstimg:
-                    return False
-                return firstimg['data-src']
+            return await self.bot.parser.run(
+                parsing.first_page_image, content)
         except aiohttp.ClientError as e:
             logger.error(f'{type(e)} - Exception: {e}')
             return None
@@ -240,11 +210,16 @@ class RSS(Cog):
         self.data = None
         self.last_item_id = None
         self.update_task = None
+        self.scheduler = AdaptiveScheduler()
+        self.delivery = WebhookDelivery(self.bot.loop)
+        self.feed_cache = None
+        self.pending_cache = None
         self.avatar = 'https://i.imgur.com/HZ27mE7.png'
         self.start_updates()
 
     def __unload(self):
         self.stop_updates()
+        self.delivery.stop()
 
     @staticmethod
     async def on_message(message):
@@ -277,69 +252,161 @@ class RSS(Cog):
 
         # wait until bot is actually finished starting up
         await self.bot.wait_until_ready()
+        await self.load_feed_cache()
+        await self.load_release_history()
 
         # loop the feed checks
         while True:
-            logger.info(f'Update Starting')
+            if await self.poll_feed():
+                self.scheduler.record_success()
+            else:
+                self.scheduler.record_error()
+            logger.info(f'Update Task Sleeping Until Next Update')
+            await self.scheduler.wait()
 
-            # get the feed data and stop if nothing received
-            feed_text = await self.get_feed()
-            if not feed_text:
-                logger.warning('  No Feed Data')
-                continue
+    async def poll_feed(self):
+        """Check the feed once. Returns whether the check succeeded."""
+        logger.info(f'Update Starting')
 
-            # parse feed to easily separate feed entries and stop if no entries
-            logger.info(f'  Parsing Feed Data')
-            entries = feedparser.parse(feed_text).entries
-            if not entries:
-                logger.error(' No Entries Found - Sleeping Until Next Update')
-                await asyncio.sleep(120)
-                continue
+        # get the feed data and stop if nothing received
+        feed_text = await self.get_feed(conditional=True)
+        if feed_text is None:
+            logger.warning('  No Feed Data')
+            return False
 
-            # get reversed new entries, converted to RSSEntry objects
-            logger.info(f'  Getting New Entries')
+        # skip parsing and db work if the feed hasn't changed
+        if feed_text == FEED_UNCHANGED:
+            logger.info(f'  Feed Unchanged')
+            return True
+
+        # parse feed to easily separate feed entries and stop if no entries
+        logger.info(f'  Parsing Feed Data')
+        entries = await self.bot.parser.run(parsing.parse_feed, feed_text)
+        if not entries:
+            logger.error('  No Entries Found')
+            return False
+
+        # get reversed new entries, converted to RSSEntry objects
+        logger.info(f'  Getting New Entries')
+        try:
             new_entries = await self.get_new_entries(entries)
-            if not new_entries:
-                logger.info(f'No New Entries - Sleeping Until Next Update')
-                await asyncio.sleep(120)
-                continue
 
-            # update each entries series data in the background
-            self.bot.loop.create_task(self.update_entries_series(new_entries))
+            # only remember this body once its entries are stored
+            await self.save_feed_cache()
+        except errors.PostgresError as e:
+            logger.exception(type(e).__name__, exc_info=e)
+            return False
 
-            self.bot.loop.create_task(self.send_to_webhooks(new_entries))
+        if not new_entries:
+            logger.info(f'  No New Entries')
+            return True
 
-            logger.info(f'Update Task Sleeping Until Next Update')
-            await asyncio.sleep(120)
-            continue
+        for entry in new_entries:
+            self.scheduler.observe(entry.updated)
+
+        # update each entries series data in the background
+        self.bot.loop.create_task(self.update_entries_series(new_entries))
+
+        self.bot.loop.create_task(self.send_to_webhooks(new_entries))
+        return True
+
+    async def load_release_history(self):
+        """Teach the scheduler when past entries were released."""
+        query = self.feed_table.query.select('updated')
+        query.order_by('updated', asc=False).limit(500)
+        for updated in await query.get_values():
+            self.scheduler.observe(updated)
+
+    @property
+    def cache_table(self):
+        return self.bot.dbi.table('feed_cache')
+
+    async def load_feed_cache(self):
+        query = self.cache_table.query.where(feed_url=HATIGARMRSS)
+        record = await query.get_first()
+        if record:
+            self.feed_cache = Map(dict(record))
+        else:
+            self.feed_cache = Map(
+                feed_url=HATIGARMRSS, etag=None, last_modified=None,
+                body_hash=None)
 
-    async def get_feed(self):
+    async def save_feed_cache(self):
+        """Store the validators of the feed body that was just processed."""
+        if not self.pending_cache:
+            return
+        self.feed_cache, self.pending_cache = self.pending_cache, None
+        insert = self.cache_table.insert(**self.feed_cache)
+        insert.primaries('feed_url')
+        await insert.commit(do_update=True)
+
+    async def get_feed(self, conditional=False):
+        """Returns the raw feed body, or ``None`` if it couldn't be fetched.
+
+        With ``conditional``, the request carries the ETag and
+        Last-Modified of the last processed body, and ``FEED_UNCHANGED``
+        is returned on a 304 or a body with the same hash. Otherwise the
+        new validators are held until :meth:`save_feed_cache`.
+        """
+        cache = self.feed_cache if conditional else None
+        headers = {}
+        if cache and cache.etag:
+            headers['If-None-Match'] = cache.etag
+        if cache and cache.last_modified:
+            headers['If-Modified-Since'] = cache.last_modified
         try:
-            async with self.bot.session.get(HATIGARMRSS) as r:
-                if r.status == 200:
-                    return await r.text()
-                logger.error(f'Feed Connect Error: Status: {r.status}')
-            return None
+            async with self.bot.session.get(
+                    HATIGARMRSS, headers=headers) as r:
+                if cache and r.status == 304:
+                    return FEED_UNCHANGED
+                if r.status != 200:
+                    logger.error(f'Feed Connect Error: Status: {r.status}')
+                    return None
+                body = await r.read()
+                etag = r.headers.get('ETag')
+                last_modified = r.headers.get('Last-Modified')
         except aiohttp.ClientError as e:
             logger.error(f'Feed Error ({type(e)}) - Exception: {e}')
             return None
+        if not cache:
+            return body
+        body_hash = hashlib.sha256(body).hexdigest()
+        self.pending_cache = Map(
+            feed_url=HATIGARMRSS, etag=etag, last_modified=last_modified,
+            body_hash=body_hash)
+        if body_hash == cache.body_hash:
+            # same body, only storing validators if the server changed them
+            if (etag, last_modified) != (cache.etag, cache.last_modified):
+                await self.save_feed_cache()
+            self.pending_cache = None
+            return FEED_UNCHANGED
+        return body
 
     async def get_new_entries(self, entries):
-        new_entries = []
-
-        for entry in entries:
-            # cast to entry object
-            entry = RSSEntry(self.bot, entry)
-            # stop going through entries if one found to already exist
-            if await entry.exists():
-                break
-            # insert the new entry into the db
-            await entry.insert()
-            # add to new entries
-            new_entries.append(entry)
+        # cast to entry objects, keeping the first of any repeated ids
+        entries = {e.item_id: e for e in reversed(
+            [RSSEntry(self.bot, Map(entry)) for entry in entries])}
+        if not entries:
+            return []
+
+        # look up every id at once instead of stopping at the first known
+        # one, so entries added out of order in the feed aren't missed
+        table = self.feed_table
+        query = table.query.use_primary().select('item_id')
+        query.where(table['item_id'].in_(entries))
+        known = set(await query.get_values())
+        unknown = [e for i, e in entries.items() if i not in known]
+        if not unknown:
+            return []
+
+        # insert all in one go, only getting back rows that weren't already
+        # added since the lookup
+        insert = table.insert.rows(e.row for e in unknown)
+        insert.returning('item_id')
+        inserted = {r['item_id'] for r in await insert.commit(do_update=False)}
 
         # return new entries from oldest to newest
-        return list(reversed(new_entries))
+        return [e for e in unknown if e.item_id in inserted]
 
     async def update_entries_series(self, entries):
         for entry in entries:
@@ -348,7 +415,16 @@ class RSS(Cog):
     async def send_to_webhooks(self, entries):
         webhooks = await self.all_webhooks()
         logger.info(f"Sending to {len(webhooks)} Webhooks")
-        await asyncio.gather(*[self.notify(wh, entries) for wh in webhooks])
+
+        # embeds are the same for every guild, so only build them once
+        embeds = await asyncio.gather(*[e.embed() for e in entries])
+        for webhook in webhooks:
+            logger.info(
+                f"{len(entries)} New Webhook Notifications:\n"
+                f"  GuildID: {webhook.guild_id}"
+                f"  Delaying for {webhook.delay}s")
+            self.delivery.schedule(
+                webhook.delay or 0, self.notify, webhook, entries, embeds)
 
     async def all_webhooks(self):
         records = await self.settings_table.query.get()
@@ -372,16 +448,72 @@ class RSS(Cog):
     def settings_table(self):
         return self.bot.dbi.table('feed_settings')
 
-    async def notify(self, webhook, entries):
-        logger.info(
-            f"{len(entries)} New Webhook Notifications:\n"
-            f"  GuildID: {webhook.guild_id}"
-            f"  Delaying for {webhook.delay}s")
+    async def notify(self, webhook, entries, embeds, do_ping=True):
+        """Send entries to a webhook, up to 10 to a message.
+
+        Notification roles are unlocked once for all the entries, and
+        the waits for role changes to apply are scheduled on the
+        delivery timer instead of being slept through.
+        """
+        messages = []
+        roles = {}
+        for i in range(0, len(entries), MAX_EMBEDS):
+            chunk = entries[i:i+MAX_EMBEDS]
+            pings = []
+            if do_ping:
+                if webhook.sub_role_id:
+                    pings.append(f"<@&{webhook.sub_role_id}>")
+                for entry in chunk:
+                    role = await entry.get_role(webhook.guild_id)
+                    if role:
+                        roles[role.id] = role
+                    pings.append(
+                        await entry.get_mention(webhook.guild_id, role))
+            content = ' '.join(dict.fromkeys(pings))
+            messages.append((content, embeds[i:i+MAX_EMBEDS]))
+
+        if do_ping and webhook.sub_role_id:
+            guild = self.bot.get_guild(webhook.guild_id)
+            n_role = discord.utils.get(guild.roles, id=webhook.sub_role_id)
+            if n_role:
+                roles[n_role.id] = n_role
+
+        roles = list(roles.values())
+        if not roles:
+            return await self.push_notifications(webhook, messages, roles)
+
+        logger.info(f"Unlocking notification roles - {webhook.guild_id}")
+        await self.set_mentionable(roles, True)
+        relock = functools.partial(self.set_mentionable, roles, False)
+        self.delivery.schedule(
+            5, self.push_notifications, webhook, messages, roles,
+            on_cancel=relock)
+
+    async def push_notifications(self, webhook, messages, roles):
+        logger.info(f"Pushing {len(messages)} Updates - {webhook.guild_id}")
+        try:
+            for content, embeds in messages:
+                await self.delivery.send(
+                    webhook.webhook, content, embeds=embeds,
+                    avatar_url=webhook.avatar)
+        finally:
+            if roles:
+                # relocked straight away if the cog unloads meanwhile
+                relock = functools.partial(self.set_mentionable, roles, False)
+                self.delivery.schedule(5, relock, on_cancel=relock)
+
+    @staticmethod
+    async def set_mentionable(roles, mentionable):
+        if not mentionable:
+            logger.info("Reverting series roles to unmentionable")
 
-        await asyncio.sleep(webhook.delay)
+        async def edit(role):
+            try:
+                await role.edit(mentionable=mentionable)
+            except discord.Forbidden:
+                pass
 
-        for entry in entries:
-            await entry.send_to_webhook(webhook)
+        await asyncio.gather(*[edit(role) for role in roles])
 
     async def test_chapter(self, url):
         if url.endswith('/'):
@@ -402,14 +534,8 @@ class RSS(Cog):
                 if r.status != 200:
                     return False
                 content = await r.text()
-                soup = bs4.BeautifulSoup(content, 'html.parser')
-                allimgs = soup.find("div", {"id": "all"})
-                if not allimgs:
-                    return False
-                firstimg = allimgs.find("img")
-                if not firstimg:
-                    return False
-                return firstimg['data-src']
+            return await self.bot.parser.run(
+                parsing.first_page_image, content)
         except aiohttp.ClientError as e:
             logger.error(f'Chapter Test Error ({type(e)}) - Exception: {e}')
             return None
@@ -430,6 +556,7 @@ class RSS(Cog):
 
     async def settings(self, guild_id, field=None):
         query = self.settings_table.query.where(guild_id=guild_id)
+        query.use_primary()
         if not field:
             return await query.get_one()
         else:
@@ -479,10 +606,35 @@ class RSS(Cog):
 
             if await checks.check_is_mod(ctx):
                 status_entries.append(f"**Delay:** {delay}")
+                status_entries.append(f"**Next Poll:** {self.next_poll_str}")
+                status_entries.append(
+                    f"**Deliveries:** {len(self.delivery.wheel)} pending, "
+                    f"{self.delivery.sent} sent, "
+                    f"{self.delivery.failed} failed")
 
             await ctx.info(
                 f'RSS | {guild.name}', '\n'.join(status_entries))
 
+    @property
+    def next_poll_str(self):
+        next_poll = self.scheduler.next_poll
+        if next_poll is None:
+            return 'Polling now' if self.update_task else 'Not running'
+        seconds = max(0, int(next_poll - time.time()))
+        msg = f'In {seconds}s'
+        if self.scheduler.errors:
+            msg += f' (backing off after {self.scheduler.errors} errors)'
+        return msg
+
+    @_rss.command()
+    @checks.is_co_owner()
+    async def poll(self, ctx):
+        """Check the feed for new releases right away."""
+        if not self.update_task:
+            return await ctx.error('Feed monitor is not running.')
+        self.scheduler.poll_now()
+        await ctx.ok()
+
     @_rss.command()
     @checks.is_admin()
     async def resend(self, ctx, number: int = 1, ping: bool = False):
@@ -507,8 +659,9 @@ class RSS(Cog):
         results = await query.limit(number).get()
         entries = [RSSEntry(self.bot, Map(dict(r))) for r in results]
 
-        for entry in reversed(entries):
-            await entry.send_to_webhook(record, do_ping=ping)
+        entries.reverse()
+        embeds = await asyncio.gather(*[e.embed() for e in entries])
+        await self.notify(record, entries, embeds, do_ping=ping)
         await ctx.ok()
 
     @_rss.command()
@@ -791,16 +944,19 @@ class RSS(Cog):
                     self.update_task._exception)
                 traceback.print_tb(
                     self.update_task._exception.__traceback__)
+        else:
+            msg += f'\n\nNext Poll: {self.next_poll_str}'
         await ctx.codeblock(msg)
 
     @command()
     async def latest(self, ctx, *, title=None):
         """Search for the latest release, filtered by given title."""
         table = self.feed_table
+        query = table.query
         if title:
-            table.query.where(table['title'].ilike(f'%{title}%'))
-        table.query.order_by('updated', asc=False)
-        result = await table.query.get_first()
+            query.where(table['title'].ilike(f'%{title}%'))
+        query.order_by('updated', asc=False)
+        result = await query.get_first()
 
         if not result:
             return await ctx.error("Sorry, I couldn't find a match.")
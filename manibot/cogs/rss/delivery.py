@@ -0,0 +1,222 @@
+import asyncio
+import collections
+import logging
+
+import discord
+
+# most embeds discord accepts in a single message
+MAX_EMBEDS = 10
+
+logger = logging.getLogger('manibot.cogs.rss.delivery')
+
+
+class TimerWheel:
+    """Runs jobs after a delay from a single ticking task.
+
+    Jobs are hashed into ``slots`` buckets by their due tick, and a job
+    more than one revolution away waits out the extra rounds in its
+    slot. Delays are rounded up to the next tick of ``resolution``
+    seconds. The ticking task only runs while jobs are pending.
+
+    A job may have an ``on_cancel`` coroutine function, run in its place
+    if the wheel is cleared first, to undo anything the job was due to
+    clean up. Once cleared, the wheel runs those straight away for any
+    job scheduled after, and drops the rest.
+
+    Parameters
+    -----------
+    loop: :class:`asyncio.AbstractEventLoop`
+        The loop the jobs run on.
+    resolution: :class:`float`
+        Seconds per tick.
+    slots: :class:`int`
+        Number of ticks in one revolution of the wheel.
+    """
+
+    def __init__(self, loop, *, resolution=1.0, slots=64):
+        self.loop = loop
+        self.resolution = resolution
+        self.slots = [[] for __ in range(slots)]
+        self.cursor = 0
+        self.pending = 0
+        self.closed = False
+        self._task = None
+
+    def __len__(self):
+        return self.pending
+
+    def schedule(self, delay, job, *args, on_cancel=None):
+        """Run coroutine function ``job`` with ``args`` after ``delay``."""
+        if self.closed:
+            if on_cancel:
+                self.loop.create_task(self._call(on_cancel, ()))
+            return
+        ticks = max(1, -(-delay // self.resolution))
+        rounds, offset = divmod(int(ticks) - 1, len(self.slots))
+        slot = (self.cursor + offset) % len(self.slots)
+        self.slots[slot].append([rounds, job, args, on_cancel])
+        self.pending += 1
+        if self._task is None or self._task.done():
+            self._task = self.loop.create_task(self._run())
+
+    async def _run(self):
+        next_tick = self.loop.time()
+        while self.pending:
+            # ticks are kept on a fixed schedule so they don't drift
+            next_tick += self.resolution
+            await asyncio.sleep(max(0, next_tick - self.loop.time()))
+            self._tick()
+
+    def _tick(self):
+        slot = self.slots[self.cursor]
+        self.cursor = (self.cursor + 1) % len(self.slots)
+        waiting = []
+        for item in slot:
+            rounds, job, args, __ = item
+            if rounds:
+                item[0] -= 1
+                waiting.append(item)
+                continue
+            self.pending -= 1
+            self.loop.create_task(self._call(job, args))
+        slot[:] = waiting
+
+    @staticmethod
+    async def _call(job, args):
+        try:
+            await job(*args)
+        except Exception as e:
+            logger.exception(type(e).__name__, exc_info=e)
+
+    def clear(self):
+        """Drop all pending jobs, running their ``on_cancel`` instead."""
+        self.closed = True
+        for slot in self.slots:
+            for __, __, __, on_cancel in slot:
+                if on_cancel:
+                    self.loop.create_task(self._call(on_cancel, ()))
+            slot.clear()
+        self.pending = 0
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+
+class RateLimit:
+    """Allows at most ``rate`` calls in any ``per`` seconds."""
+
+    def __init__(self, rate, per):
+        self.rate = rate
+        self.per = per
+        self.calls = collections.deque()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            loop = asyncio.get_event_loop()
+            while len(self.calls) >= self.rate:
+                wait = self.calls[0] + self.per - loop.time()
+                if wait <= 0:
+                    self.calls.popleft()
+                    continue
+                await asyncio.sleep(wait)
+            self.calls.append(loop.time())
+
+
+class WebhookDelivery:
+    """Sends notification messages to many webhooks at once.
+
+    Each webhook is its own Discord rate limit bucket, so messages to
+    the same webhook are sent in order and paced to ``webhook_rate``,
+    while different webhooks are sent to concurrently. Across all
+    webhooks, at most ``max_concurrency`` requests are in flight and
+    requests are paced to ``global_rate``. Rate limited or failed
+    requests are retried with backoff up to ``max_retries`` times.
+
+    Parameters
+    -----------
+    loop: :class:`asyncio.AbstractEventLoop`
+        The loop used for the delay :class:`TimerWheel`.
+    max_concurrency: :class:`int`
+        Requests allowed in flight across all webhooks.
+    global_rate: :class:`tuple`
+        ``(requests, seconds)`` allowed across all webhooks.
+    webhook_rate: :class:`tuple`
+        ``(requests, seconds)`` allowed per webhook.
+    max_retries: :class:`int`
+        Times a rate limited or server errored request is retried.
+    """
+
+    def __init__(self, loop, *, max_concurrency=10, global_rate=(30, 1),
+                 webhook_rate=(5, 2), max_retries=3):
+        self.wheel = TimerWheel(loop)
+        self.webhook_rate = webhook_rate
+        self.max_retries = max_retries
+        self.sent = 0
+        self.failed = 0
+        self._concurrency = asyncio.Semaphore(max_concurrency)
+        self._global_limit = RateLimit(*global_rate)
+        self._buckets = {}
+
+    def schedule(self, delay, job, *args, on_cancel=None):
+        """Run coroutine function ``job`` after ``delay`` seconds.
+
+        If delivery stops first, ``on_cancel`` is run instead.
+        """
+        self.wheel.schedule(delay, job, *args, on_cancel=on_cancel)
+
+    def _bucket(self, webhook_id):
+        bucket = self._buckets.get(webhook_id)
+        if bucket is None:
+            bucket = (asyncio.Lock(), RateLimit(*self.webhook_rate))
+            self._buckets[webhook_id] = bucket
+        return bucket
+
+    async def send(self, webhook, content=None, *, embeds=None, **kwargs):
+        """Send to a webhook, splitting embeds over as many messages as needed.
+
+        ``content`` is only sent with the first message.
+        """
+        embeds = list(embeds or [])
+        chunks = [embeds[i:i+MAX_EMBEDS]
+                  for i in range(0, len(embeds), MAX_EMBEDS)] or [None]
+        for chunk in chunks:
+            await self._send(webhook, content=content, embeds=chunk, **kwargs)
+            content = None
+
+    async def _send(self, webhook, **kwargs):
+        lock, limit = self._bucket(webhook.id)
+        async with lock:
+            for attempt in range(self.max_retries + 1):
+                async with self._concurrency:
+                    await self._global_limit.acquire()
+                    await limit.acquire()
+                    try:
+                        await webhook.send(**kwargs)
+                    except discord.HTTPException as e:
+                        if e.status != 429 and e.status < 500:
+                            self.failed += 1
+                            raise
+                        if attempt == self.max_retries:
+                            self.failed += 1
+                            raise
+                        retry_after = self._retry_after(e, attempt)
+                        logger.warning(
+                            f'Webhook {webhook.id} got {e.status}, '
+                            f'retrying in {retry_after:.1f}s')
+                    else:
+                        self.sent += 1
+                        return
+                await asyncio.sleep(retry_after)
+
+    @staticmethod
+    def _retry_after(error, attempt):
+        headers = getattr(error.response, 'headers', None) or {}
+        try:
+            return float(headers['Retry-After'])
+        except (KeyError, ValueError):
+            return 2 ** attempt
+
+    def stop(self):
+        """Drop pending deliveries, running their clean up jobs now."""
+        self.wheel.clear()
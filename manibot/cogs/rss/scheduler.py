@@ -0,0 +1,98 @@
+import asyncio
+import random
+import time
+from datetime import datetime, timezone
+
+HOURS_PER_WEEK = 168
+
+
+class AdaptiveScheduler:
+    """Decides how long the feed monitor waits between polls.
+
+    Polls more often around the hours releases usually come out. Release
+    times are counted per hour of the week. Hours with at least an
+    average share of releases, counting an hour either side, are polled
+    every ``min_interval`` seconds. Hours with no releases within
+    ``quiet_hours`` either side, such as overnight, are polled every
+    ``max_interval``. All other hours use ``default_interval``.
+
+    After failed polls the wait backs off exponentially from
+    ``error_base`` up to ``error_max`` seconds instead, with jitter so a
+    recovering site isn't hit at a predictable moment.
+
+    Attributes
+    -----------
+    next_poll: :class:`float`
+        Unix time of the next scheduled poll, or ``None`` while polling.
+    errors: :class:`int`
+        Failed polls in a row.
+    """
+
+    def __init__(self, *, min_interval=60, default_interval=300,
+                 max_interval=1800, quiet_hours=3, error_base=30,
+                 error_max=1800):
+        self.min_interval = min_interval
+        self.default_interval = default_interval
+        self.max_interval = max_interval
+        self.quiet_hours = quiet_hours
+        self.error_base = error_base
+        self.error_max = error_max
+        self.releases = [0] * HOURS_PER_WEEK
+        self.errors = 0
+        self.next_poll = None
+        self._wake = asyncio.Event()
+
+    def delay(self):
+        if not self.errors:
+            return self.interval()
+        cap = min(self.error_max, self.error_base * 2 ** (self.errors - 1))
+        return random.uniform(cap / 2, cap)
+
+    def record_success(self):
+        self.errors = 0
+
+    def record_error(self):
+        self.errors += 1
+
+    async def wait(self):
+        """Sleep until the next poll is due or one is forced."""
+        delay = self.delay()
+        self.next_poll = time.time() + delay
+        try:
+            await asyncio.wait_for(self._wake.wait(), delay)
+        except asyncio.TimeoutError:
+            pass
+        # cleared after waking so a poll forced mid-update isn't lost
+        self._wake.clear()
+        self.next_poll = None
+
+    def poll_now(self):
+        """End the current wait so the feed is polled straight away."""
+        self._wake.set()
+
+    @staticmethod
+    def hour_of_week(when):
+        if when.tzinfo:
+            when = when.astimezone(timezone.utc)
+        return when.weekday() * 24 + when.hour
+
+    def observe(self, published):
+        """Note the publish time of a feed entry."""
+        if published:
+            self.releases[self.hour_of_week(published)] += 1
+
+    def _releases_near(self, hour, span):
+        return sum(self.releases[(hour + i) % HOURS_PER_WEEK]
+                   for i in range(-span, span + 1))
+
+    def interval(self):
+        """Returns the seconds to wait after a successful poll."""
+        total = sum(self.releases)
+        if not total:
+            return self.default_interval
+        hour = self.hour_of_week(datetime.utcnow())
+        if self._releases_near(hour, 1) >= total / HOURS_PER_WEEK * 3:
+            return self.min_interval
+        if not self._releases_near(hour, self.quiet_hours):
+            return self.max_interval
+        return self.default_interval
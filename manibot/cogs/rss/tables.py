@@ -6,7 +6,7 @@ def setup(bot):
         schema.StringColumn('item_id', primary_key=True),
         schema.StringColumn('title'),
         schema.StringColumn('link'),
-        schema.DatetimeColumn('updated'),
+        schema.DatetimeColumn('updated', index=True),
         schema.StringColumn('author'),
         schema.StringColumn('summary'),
         schema.StringColumn('content')
@@ -23,4 +23,13 @@ def setup(bot):
         schema.BoolColumn('enabled')
         ]
 
-    return [feed_data, feed_settings]
+    # conditional request validators of the last processed feed body
+    feed_cache = bot.dbi.table('feed_cache')
+    feed_cache.new_columns = [
+        schema.StringColumn('feed_url', primary_key=True),
+        schema.StringColumn('etag'),
+        schema.StringColumn('last_modified'),
+        schema.StringColumn('body_hash')
+        ]
+
+    return [feed_data, feed_settings, feed_cache]
@@ -3,7 +3,6 @@ import asyncio
 import urllib
 import textwrap
 
-import bs4
 import asyncpg
 
 import discord
@@ -11,6 +10,7 @@ import discord
 from manibot import group, Cog, checks, command
 from manibot.utils.formatters import make_embed
 from manibot.utils.fuzzymatch import get_partial_match
+from manibot.utils import parsing
 
 HATIGARMURL = "https://www.hatigarmscans.net/"
 
@@ -222,26 +222,11 @@ class Series(Cog):
             if r.status != 200:
                 return False
             content = await r.text()
-            soup = bs4.BeautifulSoup(content, 'html.parser')
-
-        title = soup.find_all('h2', class_='widget-title')[0].get_text()
-        table_values = soup.find_all('dd')
-        table_titles = soup.find_all('dt')
-        table = dict(
-            zip([t.get_text(strip=True) for t in table_titles], table_values))
-
-        info = {'Title': title, 'URL': data['link']}
-        for k, v in table.items():
-            if k in ['Categories', 'Tags']:
-                v = [i.string for i in v if '\n' not in i.string]
-                info[k] = v
-            else:
-                info[k] = v.get_text(strip=True)
-
-        chapter_data = soup.find_all('h5', class_='chapter-title-rtl')
+        page = await self.bot.parser.run(parsing.series_page, content)
 
-        chapters = [(i.a.get_text(), i.a['href']) for i in chapter_data]
-        info['Chapters'] = chapters
+        info = {'Title': page['title'], 'URL': data['link']}
+        info.update(page['details'])
+        info['Chapters'] = page['chapters']
 
         await ctx.send(embed=self.web_info_embed(series, **info))
 
@@ -274,25 +259,10 @@ class Series(Cog):
             if r.status != 200:
                 return await ctx.error('The given link was invalid')
             content = await r.text()
-            soup = bs4.BeautifulSoup(content, 'html.parser')
-
-        title = soup.find_all('h2', class_='widget-title')[0].get_text()
-        table_values = soup.find_all('dd')
-        table_titles = soup.find_all('dt')
-        table = dict(
-            zip([t.get_text(strip=True) for t in table_titles], table_values))
-
-        info = {}
-
-        for k, v in table.items():
-            if k in ['Categories', 'Tags']:
-                v = [i.string for i in v if '\n' not in i.string]
-                info[k] = v
-            else:
-                info[k] = v.get_text(strip=True)
+        page = await self.bot.parser.run(parsing.series_page, content)
 
-        chapter_data = soup.find_all('h5', class_='chapter-title-rtl')
-        chapters = [(i.a.get_text(), i.a['href']) for i in chapter_data]
+        title = page['title']
+        chapters = page['chapters']
         latest_chapter = f"[{chapters[0][0]}]({chapters[0][1]})"
         chapter_count = len(chapters)
 
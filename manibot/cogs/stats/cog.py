@@ -32,16 +32,25 @@ class Statistics:
 
         guild = guild or ctx.guild
         member = member or ctx.author
-        query = ctx.bot.dbi.table('discord_messages').query('sent')
-        query.where(guild_id=guild.id, is_edit=False, author_id=member.id)
-        query.order_by('sent', asc=False)
-        data = await query.get_values()
+        table = ctx.bot.dbi.table('message_counts')
+        query = table.query('day', 'messages')
+        query.where(guild_id=guild.id, author_id=member.id)
+        days = await query.get()
 
-        if not data:
+        if not days:
             return await ctx.error(
                 f"I haven't seen {member.display_name} before.")
 
-        dates = mdates.epoch2num(data)
+        # bin the daily counts from the rollup
+        bin_count = 10
+        first = mdates.date2num(min(d['day'] for d in days))
+        last = mdates.date2num(max(d['day'] for d in days)) + 1
+        width = (last - first) / bin_count
+        counts = [0] * bin_count
+        for d in days:
+            index = int((mdates.date2num(d['day']) - first) / width)
+            counts[min(index, bin_count - 1)] += d['messages']
+        edges = [first + width * i for i in range(bin_count + 1)]
 
         fig, ax = plt.subplots(linewidth=0, sharey=True, tight_layout=True)
         fig.set_size_inches(8, 4)
@@ -51,8 +60,9 @@ class Statistics:
         ax.xaxis.set_major_locator(locator)
         ax.xaxis.set_major_formatter(mdates.DateFormatter('%d %b'))
 
-        __, bins, __ = ax.hist(dates, 10, facecolor='red', alpha=0.75)
-        ax.set_xticks(bins)
+        ax.hist(edges[:-1], edges, weights=counts,
+                facecolor='red', alpha=0.75)
+        ax.set_xticks(edges)
 
         plot_bytes = io.BytesIO()
         fig.savefig(
@@ -73,26 +83,32 @@ class Statistics:
 
     @command()
     async def mostactive(self, ctx):
-        table = ctx.bot.dbi.table('discord_messages')
+        table = ctx.bot.dbi.table('message_counts')
         query = table.query(
             'author_id',
-            table['message_id'].count,
-            "rank() over (order by count(message_id) desc) as rank")
-        query.where(guild_id=ctx.guild.id, is_edit=False)
+            "sum(messages) as count",
+            "rank() over (order by sum(messages) desc) as rank")
+        query.where(guild_id=ctx.guild.id)
         query.order_by('count', asc=False)
         query.group_by('author_id')
-        data = await query.get()
 
-        if not data:
-            return await ctx.error('No data found.')
+        # only the top ten and the author's own rank are needed
+        top = []
+        author_data = None
+        async for m in query.stream():
+            if len(top) < 10:
+                top.append(m)
+            if m['author_id'] == ctx.author.id:
+                author_data = m
 
-        author_data = [m for m in data if m['author_id'] == ctx.author.id][0]
+        if not top:
+            return await ctx.error('No data found.')
 
         data = {
             (
                 str(ctx.get.member(m['author_id'], ctx.guild.id))
                 if ctx.get.member(m['author_id'], ctx.guild.id) else str(m['author_id'])
-            ) :m['count'] for m in data[:10]
+            ) :m['count'] for m in top
         }
 
         if author_data and str(ctx.author) not in data:
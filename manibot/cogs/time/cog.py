@@ -73,9 +73,9 @@ class Time(Cog):
 
     async def get_timezone(self, member_id):
         table = self.bot.dbi.table('member_timezones')
-        table.query('timezone')
-        table.query.where(member_id=member_id)
-        return await table.query.get_value()
+        query = table.query('timezone')
+        query.where(member_id=member_id)
+        return await query.get_value()
 
     async def verify_timezone(self, ctx, timezone):
 
@@ -156,11 +156,11 @@ class Time(Cog):
                 return await ctx.error('Invalid Timezone.')
 
         table = ctx.bot.dbi.table('member_timezones')
-        table.insert(
+        insert = table.insert(
             member_id=member.id,
             timezone=str(timezone))
-        table.insert.primaries('member_id')
-        await table.insert.commit(do_update=True)
+        insert.primaries('member_id')
+        await insert.commit(do_update=True)
 
         await ctx.success(
             f'Timezone for {member.display_name} saved as {timezone}.')
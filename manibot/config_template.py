@@ -17,7 +17,17 @@ db_details = {
     'username' : 'manibot',
     'database' : 'manibot',
     'hostname' : 'localhost',
-    'password' : 'password'
+    'password' : 'password',
+    # sync prefix changes between bot processes sharing the database
+    'prefix_notify' : False,
+    # months of message and activity history to keep, None keeps all
+    'retention_months' : None,
+    # detach expired months as standalone tables instead of dropping them
+    'retention_detach' : False,
+    # read replica DSNs for queries, e.g. 'postgres://user:pw@host:5433/db'
+    'read_dsns' : [],
+    # statements slower than this many milliseconds are logged as slow
+    'slow_query_ms' : 500
 }
 
 # default language
@@ -20,6 +20,7 @@ from manibot.core.cog_base import NewCog
 from manibot.core.context import Context
 from manibot.core.data_manager import DatabaseInterface, DataManager
 from manibot.utils import ExitCodes, pagination, fuzzymatch, make_embed
+from manibot.utils.parsing import ParseExecutor
 
 
 class Bot(commands.AutoShardedBot):
@@ -55,6 +56,8 @@ class Bot(commands.AutoShardedBot):
         The interface for interacting directly with the database.
     data: :py:class:`.DataManager`
         The interface for getting and updating common data in the database.
+    parser: :class:`manibot.utils.parsing.ParseExecutor`
+        Runs feed and HTML parsing off the event loop.
     """
 
     def __init__(self, **kwargs):
@@ -65,6 +68,9 @@ class Bot(commands.AutoShardedBot):
         self.debug = kwargs.pop('debug')
         self.from_restart = kwargs.pop('from_restart')
         self.counter = Counter()
+        # log handlers and buffers that write to the database, stopped
+        # on shutdown before the database interface so they can flush
+        self.db_flushers = []
         self.launch_time = None
         self.core_dir = os.path.dirname(os.path.realpath(__file__))
         self.bot_dir = os.path.dirname(self.core_dir)
@@ -83,6 +89,7 @@ class Bot(commands.AutoShardedBot):
                       status=discord.Status.dnd, **kwargs)
         super().__init__(**kwargs)
         self.session = aiohttp.ClientSession(loop=self.loop)
+        self.parser = ParseExecutor(loop=self.loop)
         self.loop.run_until_complete(self._db_connect())
         self.logger = logging.getLogger('manibot.Bot')
 
@@ -125,7 +132,10 @@ class Bot(commands.AutoShardedBot):
         else:
             self.shutdown_mode = ExitCodes.RESTART
         await self.logout()
+        for flusher in self.db_flushers:
+            await flusher.stop()
         await self.dbi.stop()
+        self.parser.shutdown(wait=False)
 
     @cached_property
     def invite_url(self):
@@ -303,9 +313,9 @@ class Bot(commands.AutoShardedBot):
 
         if self.from_restart:
             table = self.dbi.table('restart_savedata')
-            table.query.order_by(table['restart_snowflake'], asc=False)
-            table.query.limit(1)
-            last_restart = (await table.query.get())[0]
+            query = table.query.order_by(table['restart_snowflake'], asc=False)
+            query.limit(1)
+            last_restart = (await query.get())[0]
 
             embed = make_embed(title='Restart Complete.', msg_type='success')
 
@@ -77,12 +77,16 @@ class Cog:
         if not isinstance(cog_tables, (list, tuple)):
             cog_tables = [cog_tables]
         self.tables = Map({t.name:t for t in cog_tables})
+        table_sqls = {t.name: t.sql_create() for t in cog_tables}
+        indexes = {t.name: t.table_indexes() for t in cog_tables}
+        created = await self.bot.dbi.bootstrap_tables(table_sqls, indexes)
         for table in self.tables.values():
-            if await table.exists():
+            if table.name in created:
+                self.logger.info(
+                    f'Cog table {table.name} for {cog_name} created.')
+            else:
                 self.logger.info(
                     f'Cog table {table.name} for {cog_name} found.')
-                table.new_columns = []
-                continue
-            await table.create()
-            self.logger.info(f'Cog table {table.name} for {cog_name} created.')
+            table.new_columns = []
+            table.new_indexes = []
         del table_module
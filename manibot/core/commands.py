@@ -1,4 +1,5 @@
 import asyncio
+import datetime
 import json
 import os
 import textwrap
@@ -71,8 +72,8 @@ class Core:
         if restart_msg:
             data['restart_message'] = restart_msg.id
         table = ctx.bot.dbi.table('restart_savedata')
-        table.insert(**data)
-        await table.insert.commit()
+        insert = table.insert(**data)
+        await insert.commit()
         await ctx.bot.shutdown(restart=True)
 
     @group(name="set", category='Owner')
@@ -280,13 +281,13 @@ class Core:
             server_count += 1
             member_count += guild.member_count
 
-        msg_table = bot.dbi.table('discord_messages')
-        msg_table.query(msg_table['*'].count)
-        message_count = await msg_table.query.get_value()
+        # summed from the daily rollup rather than counting every message
+        count_table = bot.dbi.table('message_counts')
+        query = count_table.query(count_table['messages'].sum)
+        message_count = await query.get_value() or 0
 
-        cmd_table = bot.dbi.table('command_log')
-        cmd_table.query(cmd_table['*'].count)
-        command_count = await cmd_table.query.get_value()
+        # estimated, as counting every logged command scans all history
+        command_count = await bot.dbi.estimate_rows('command_log')
 
         embed = make_embed(
             msg_type='info', title="Bot Statistics")
@@ -301,8 +302,12 @@ class Core:
             f"**Servers:** {server_count}\n"
             f"**Members:** {member_count}\n"
             f"**Messages:** {message_count}\n"
-            f"**Commands:** {command_count}\n"
-            f"**Reconnects:** {bot.resumed_count}")
+            f"**Commands:** ~{command_count}\n"
+            f"**Reconnects:** {bot.resumed_count}\n"
+            f"**Database:** {bot.dbi.breaker.state}")
+        replicas = [b.state for b in bot.dbi.read_breakers.values()]
+        if replicas:
+            session_msg += f"\n**Replicas:** {', '.join(replicas)}"
         process_msg = (
             f"**PID:** {ppid}\n"
             f"**RAM:** {p_mem_str}\n"
@@ -318,6 +323,42 @@ class Core:
         except discord.HTTPException:
             await ctx.send("I need the `Embed links` permission to send this")
 
+    @group(name="querystats", category='Owner', aliases=['qstats'],
+           invoke_without_command=True)
+    @checks.is_co_owner()
+    async def _querystats(self, ctx, count: int = 10, sort: str = 'total'):
+        """Shows the database statements taking the most time.
+
+        Sort by total, mean, max, calls, wait, rows or errors.
+        """
+        keys = dict(total='total_time', mean='mean_time', max='max_time',
+                    calls='calls', wait='wait_time', rows='rows',
+                    errors='errors')
+        if sort not in keys:
+            return await ctx.error(
+                f"Sort by one of: {', '.join(keys)}")
+        query_stats = ctx.bot.dbi.query_stats
+        since = datetime.datetime.utcfromtimestamp(query_stats.since)
+        output = [f"Since {since:%Y-%m-%d %H:%M:%S} UTC"]
+        for stats in query_stats.top(count, keys[sort]):
+            p95 = stats.percentile(95)
+            p95 = f"<={p95}" if p95 else ">5000"
+            output.append('-'*40)
+            output.append(
+                f"calls {stats.calls} | total {stats.total_time:.0f}ms | "
+                f"mean {stats.mean_time:.1f}ms | p95 {p95}ms | "
+                f"max {stats.max_time:.0f}ms | wait {stats.wait_time:.0f}ms "
+                f"| rows {stats.rows} | errors {stats.errors}")
+            output.append(' '.join(stats.statement.split())[:300])
+        await ctx.codeblock('\n'.join(output), syntax='')
+
+    @_querystats.command(name='reset')
+    @checks.is_co_owner()
+    async def _querystats_reset(self, ctx):
+        """Clears the collected statement stats."""
+        ctx.bot.dbi.query_stats.reset()
+        await ctx.ok()
+
     @group(name="get", category="Owner", invoke_without_command=True)
     async def _get(self, ctx):
         """Gets information on settings, guilds, channels and users"""
@@ -618,13 +659,30 @@ class Core:
             await ctx.send(embed=embed)
             raise
 
+    @command(category='Server Config', name='presencelog')
+    @commands.guild_only()
+    @checks.is_admin()
+    async def _presencelog(self, ctx, enabled: bool = None):
+        """Show or set whether member status changes are logged here."""
+        if enabled is not None:
+            await ctx.setting('PresenceLogging', enabled)
+        else:
+            value = await ctx.setting('PresenceLogging')
+            enabled = value is None or convert_to_bool(value) is not False
+        state = 'on' if enabled else 'off'
+        embed = make_embed(
+            msg_type='info', title=f'Presence logging is {state}.')
+        await ctx.send(embed=embed)
+
     @_enable.command(name='list')
     @checks.is_admin()
     async def _list(self, ctx):
         """List all loaded cogs."""
         cog_list = []
+        keys = [f'{cog}Enabled' for cog in ctx.bot.cogs]
+        values = await ctx.guild_dm.settings_many(*keys)
         for cog in ctx.bot.cogs:
-            value = await ctx.setting(f'{cog}Enabled')
+            value = values[f'{cog}Enabled']
             if value is not None:
                 value = convert_to_bool(value)
             if value is None:
@@ -3,3 +3,8 @@ from .dbi import DatabaseInterface
 from .schema import Table
 from .errors import SchemaError
 from .tables import CogTable
+from .registry import SchemaRegistry
+from .settings import SettingsCache
+from .writer import BatchWriter
+from .partitions import PartitionManager
+from .metrics import QueryStats
@@ -0,0 +1,93 @@
+import time
+
+from .errors import DatabaseUnavailableError
+
+
+class CircuitBreaker:
+    """Fails database calls fast while the database is unreachable.
+
+    After ``failure_threshold`` connection failures in a row the breaker
+    opens and calls are rejected without touching the pool. Once the
+    open timeout has passed a single call is let through to probe the
+    database: success closes the breaker, while failure opens it again
+    with double the timeout, up to ``max_timeout``.
+
+    Parameters
+    -----------
+    failure_threshold: :class:`int`
+        Connection failures in a row that open the breaker.
+    reset_timeout: :class:`float`
+        Seconds the breaker first stays open before probing.
+    max_timeout: :class:`float`
+        Longest the breaker stays open before probing.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, *, failure_threshold=5, reset_timeout=1.0,
+                 max_timeout=60.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.max_timeout = max_timeout
+        self.failures = 0
+        self.trips = 0
+        self.rejected = 0
+        self.opened_at = None
+        self.timeout = reset_timeout
+        self._probing = False
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return self.CLOSED
+        if time.monotonic() - self.opened_at < self.timeout:
+            return self.OPEN
+        return self.HALF_OPEN
+
+    @property
+    def retry_in(self):
+        """Seconds until the next probe is allowed, if open."""
+        if self.opened_at is None:
+            return 0
+        return max(0, self.opened_at + self.timeout - time.monotonic())
+
+    @property
+    def stats(self):
+        return dict(
+            state=self.state, failures=self.failures, trips=self.trips,
+            rejected=self.rejected, retry_in=self.retry_in)
+
+    def check(self):
+        """Raise :class:`DatabaseUnavailableError` if calls aren't allowed."""
+        state = self.state
+        if state == self.CLOSED:
+            return
+        if state == self.HALF_OPEN and not self._probing:
+            self._probing = True
+            return
+        self.rejected += 1
+        raise DatabaseUnavailableError(
+            f'Database unavailable, retrying in {self.retry_in:.0f}s.')
+
+    def record_success(self):
+        self.failures = 0
+        self.trips = 0
+        self.opened_at = None
+        self.timeout = self.reset_timeout
+        self._probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self._probing:
+            # the probe failed, so stay open for longer
+            self.timeout = min(self.timeout * 2, self.max_timeout)
+            self._open()
+        elif self.opened_at is None and self.failures >= self.failure_threshold:
+            self._open()
+
+    def _open(self):
+        self.trips += 1
+        self.opened_at = time.monotonic()
+        self._probing = False
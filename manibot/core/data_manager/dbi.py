@@ -1,75 +1,580 @@
+import asyncio
+import collections
+import json
 import logging
 
 import asyncpg
 
 from discord.ext.commands import when_mentioned_or
 
-from .schema import Table, Query, Insert, Update
-from .tables import core_table_sqls
+from .schema import Table, Query, Insert, Update, SQL_CACHE_SIZE
+from .tables import (
+    core_table_sqls, core_indexes, PARTITIONED_TABLES,
+    MESSAGE_COUNTS_BACKFILL, PRIMARY_KEY_SQL, SECONDS_BEFORE)
+from .partitions import PartitionManager
+from .breaker import CircuitBreaker
+from .metrics import QueryStats
+from .errors import DatabaseUnavailableError
+from .registry import SchemaRegistry
+from .settings import SettingsCache
+from .writer import BatchWriter
 from . import sqltypes
 
+PREFIX_CHANNEL = 'manibot_prefix'
+
+# errors that mean the connection to the database itself was lost
+DISCONNECT_ERRORS = (
+    asyncpg.exceptions.ConnectionDoesNotExistError,
+    asyncpg.exceptions.PostgresConnectionError,
+    asyncpg.exceptions.CannotConnectNowError,
+    OSError,
+)
+
+# kind of each table and its indexes left invalid by a failed build
+INDEX_STATE_SQL = """
+SELECT t.name, c.relkind,
+       coalesce(array_agg(ic.relname) FILTER (WHERE NOT i.indisvalid),
+                '{}') AS invalid
+FROM unnest($1::text[]) AS t(name)
+JOIN pg_catalog.pg_class c ON c.oid = to_regclass(t.name)
+LEFT JOIN pg_catalog.pg_index i ON i.indrelid = c.oid
+LEFT JOIN pg_catalog.pg_class ic ON ic.oid = i.indexrelid
+GROUP BY t.name, c.relkind;
+"""
+
+# hot statements prepared on every pooled connection
+NAMED_STATEMENTS = {
+    'prefixes': 'SELECT guild_id, prefix FROM prefix;',
+    'guild_config': ('SELECT config_name, config_value FROM guild_config '
+                     'WHERE guild_id=$1;'),
+}
+
+
+class Connection(asyncpg.connection.Connection):
+    """Pooled connection that keeps its named prepared statements."""
+
+    named_statements = None
+
+
 class DatabaseInterface:
-    """Get, Create and Edit data in the connected database."""
+    """Get, Create and Edit data in the connected database.
+
+    Guild prefixes are held in memory in ``prefixes``, loaded when the
+    interface starts and updated by :meth:`prefix_changed`. With
+    ``prefix_notify`` enabled, changes are also sent with Postgres
+    ``NOTIFY`` so other bot processes sharing the database stay in sync.
+
+    A lost connection makes one shared attempt to recreate the pool, with
+    backoff between retries. Repeated failures open ``breaker``, which
+    rejects calls with :class:`DatabaseUnavailableError` until the
+    database answers again.
+
+    With ``read_dsns`` given, queries built with :class:`Query` are sent
+    to the least busy read replica, falling back to the primary if the
+    replica can't be reached. Each replica has its own breaker in
+    ``read_breakers``, so one that failed is skipped until a probe
+    finds it back up, instead of every read waiting out its timeout.
+    Writes, transactions and prepared named statements always use the
+    primary, as does any query marked with :meth:`Query.use_primary` to
+    read its own writes.
+    """
 
     def __init__(self,
                  password,
                  hostname='localhost',
                  username='manibot',
                  database="manibot",
-                 port=5432):
+                 port=5432,
+                 prefix_notify=False,
+                 statement_cache_size=SQL_CACHE_SIZE,
+                 retention_months=None,
+                 retention_detach=False,
+                 read_dsns=None,
+                 slow_query_ms=500):
         self.loop = None
         self.dsn = "postgres://{}:{}@{}:{}/{}".format(
             username, password, hostname, port, database)
         self.pool = None
-        self.prefix_conn = None
-        self.prefix_stmt = None
-        self.settings_conn = None
-        self.settings_stmt = None
+        self.read_dsns = list(read_dsns or [])
+        self.read_pools = []
+        self.read_breakers = {}
+        self._read_turn = 0
+        self._busy = collections.Counter()
+        self.pool_kwargs = dict(
+            statement_cache_size=statement_cache_size,
+            connection_class=Connection,
+            init=self._init_connection)
+        self.named_sql = dict(NAMED_STATEMENTS)
+        self.prefixes = {}
+        self.prefix_notify = prefix_notify
+        self.listen_conn = None
+        self.settings = SettingsCache(self)
+        self.schema = SchemaRegistry(self)
+        self.partitions = PartitionManager(
+            self, retention_months=retention_months, detach=retention_detach)
+        for table, (column, scale) in PARTITIONED_TABLES.items():
+            self.partitions.register(table, column, scale=scale)
+        self.breaker = CircuitBreaker()
+        self.query_stats = QueryStats(slow_ms=slow_query_ms)
+        self.reconnect_attempts = 5
+        self.writers = []
+        self._reconnect_task = None
+        self._tables = {}
+        self._pending_tables = {}
+        self._pending_indexes = {}
+        self._pending_populate = {}
+        self._bootstrap_task = None
         self.types = sqltypes
         self.log = logging.getLogger('manibot.core.dbi.DatabaseInterface')
 
     async def start(self, loop=None):
         if loop:
             self.loop = loop
-        self.pool = await asyncpg.create_pool(self.dsn, loop=loop)
+        self.pool = await asyncpg.create_pool(
+            self.dsn, loop=loop, **self.pool_kwargs)
+        for dsn in self.read_dsns:
+            pool = await asyncpg.create_pool(
+                dsn, loop=loop, **self.pool_kwargs)
+            self.read_pools.append(pool)
+            # one failure is enough to stop routing reads to a replica
+            self.read_breakers[pool] = CircuitBreaker(failure_threshold=1)
         await self.prepare()
 
-    async def recreate_pool(self):
-        self.log.warning(f'Re-creating closed database pool.')
-        self.pool = await asyncpg.create_pool(self.dsn, loop=self.loop)
+    def read_pool(self):
+        """Returns the healthy replica pool with the fewest queries running.
+
+        Replicas that are equally busy take turns. Returns ``None`` if
+        every replica's breaker is open.
+        """
+        if not self.read_pools:
+            return None
+        self._read_turn = (self._read_turn + 1) % len(self.read_pools)
+        turn = self._read_turn
+        pools = self.read_pools[turn:] + self.read_pools[:turn]
+        for pool in sorted(pools, key=lambda pool: self._busy[pool]):
+            try:
+                self.read_breakers[pool].check()
+            except DatabaseUnavailableError:
+                continue
+            return pool
+        return None
+
+    def _replica_failed(self, pool, error):
+        self.read_breakers[pool].record_failure()
+        self.log.warning(
+            f'Read replica marked unavailable: {type(error)}: {error}')
+
+    async def _execute_read(self, func, statement):
+        # replica errors fall back to the primary rather than failing
+        pool = self.read_pool()
+        if pool is None:
+            return await self._execute(func, statement=statement)
+        self._busy[pool] += 1
+        timer = self.query_stats.timer(statement)
+        try:
+            async with pool.acquire() as conn:
+                timer.acquired()
+                result = await func(conn)
+        except Exception as e:
+            timer.done(error=True)
+            if not self._is_disconnect(e, pool):
+                # the replica answered, so it's up
+                self.read_breakers[pool].record_success()
+                raise
+            self._replica_failed(pool, e)
+        else:
+            timer.done(result)
+            self.read_breakers[pool].record_success()
+            return result
+        finally:
+            self._busy[pool] -= 1
+        return await self._execute(func, statement=statement)
+
+    def _is_disconnect(self, error, pool):
+        if isinstance(error, DISCONNECT_ERRORS):
+            return True
+        # other interface errors only count once the pool has been closed
+        return (isinstance(error, asyncpg.exceptions.InterfaceError)
+                and pool._closed)
+
+    async def reconnect(self, broken_pool=None):
+        """Replace the pool, with all callers sharing a single attempt.
+
+        If ``broken_pool`` has already been replaced, returns straight away.
+        """
+        if broken_pool is not None and broken_pool is not self.pool:
+            return
+        if not self._reconnect_task:
+            self._reconnect_task = asyncio.ensure_future(
+                self._reconnect(), loop=self.loop)
+        await asyncio.shield(self._reconnect_task)
+
+    async def _reconnect(self):
+        old_pool = self.pool
+        delay = self.breaker.reset_timeout
+        try:
+            for attempt in range(1, self.reconnect_attempts + 1):
+                self.log.warning(
+                    f'Re-creating database pool, attempt {attempt}.')
+                try:
+                    self.pool = await asyncpg.create_pool(
+                        self.dsn, loop=self.loop, **self.pool_kwargs)
+                except (OSError, asyncio.TimeoutError,
+                        asyncpg.PostgresError) as e:
+                    self.log.error(f'Exception {type(e)}: {e}')
+                    self.breaker.record_failure()
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, self.breaker.max_timeout)
+                else:
+                    self.breaker.record_success()
+                    asyncio.ensure_future(
+                        self._close_pool(old_pool), loop=self.loop)
+                    if self.listen_conn:
+                        self.listen_conn = None
+                        asyncio.ensure_future(
+                            self._resync_prefixes(), loop=self.loop)
+                    return
+            raise DatabaseUnavailableError(
+                f'Could not reconnect after {self.reconnect_attempts} '
+                f'attempts.')
+        finally:
+            self._reconnect_task = None
+
+    async def _close_pool(self, pool, timeout=10):
+        try:
+            await asyncio.wait_for(pool.close(), timeout)
+        except (asyncio.TimeoutError, OSError, asyncpg.PostgresError,
+                asyncpg.exceptions.InterfaceError):
+            pool.terminate()
+
+    async def _execute(self, func, *, retry=True, statement=None):
+        """Run ``func`` with a pooled connection, handling lost connections.
+
+        While the circuit breaker is open this raises
+        :class:`DatabaseUnavailableError` without using the pool. If the
+        connection is lost, the pool is recreated and ``func`` is run once
+        more. With ``retry`` false, that only happens if it was lost while
+        acquiring the connection, so a write that may have reached the
+        database is never sent twice.
+
+        Each call is timed against ``statement`` in ``query_stats``.
+        """
+        for attempt in (1, 2):
+            self.breaker.check()
+            pool = self.pool
+            timer = self.query_stats.timer(statement)
+            try:
+                async with pool.acquire() as conn:
+                    timer.acquired()
+                    result = await func(conn)
+            except Exception as e:
+                timer.done(error=True)
+                if not self._is_disconnect(e, pool):
+                    # the database answered, so it's up
+                    self.breaker.record_success()
+                    raise
+                self.log.error(f'Exception {type(e)}: {e}')
+                self.breaker.record_failure()
+                acquired = timer.acquired_at is not None
+                if attempt == 2 or (acquired and not retry):
+                    raise DatabaseUnavailableError(str(e)) from e
+                await self.reconnect(pool)
+            else:
+                timer.done(result)
+                self.breaker.record_success()
+                return result
+
+    async def _init_connection(self, conn):
+        conn.named_statements = {}
+        for name, query in self.named_sql.items():
+            try:
+                conn.named_statements[name] = await conn.prepare(query)
+            except asyncpg.UndefinedTableError:
+                # table not created yet, prepare when first used
+                pass
+
+    def register_statement(self, name, query):
+        """Add a named statement to be prepared on each pooled connection.
+
+        Connections that are already open prepare it on first use.
+        """
+        self.named_sql[name] = query
+
+    async def execute_named(self, name, *query_args):
+        """Run a named prepared statement on any free pooled connection."""
+        query = self.named_sql[name]
+
+        async def run(conn):
+            stmt = conn.named_statements.get(name)
+            if stmt is None:
+                stmt = await conn.prepare(query)
+                conn.named_statements[name] = stmt
+            try:
+                return await stmt.fetch(*query_args)
+            except asyncpg.InvalidCachedStatementError:
+                # schema changed under the statement, so prepare again
+                stmt = await conn.prepare(query)
+                conn.named_statements[name] = stmt
+                return await stmt.fetch(*query_args)
+
+        return await self._execute(run, statement=query)
 
     async def prepare(self):
         # ensure tables exists
         await self.core_tables_exist()
 
-        # guild prefix callable statement
-        self.prefix_conn = await self.pool.acquire()
-        prefix_sql = 'SELECT prefix FROM prefix WHERE guild_id=$1;'
-        self.prefix_stmt = await self.prefix_conn.prepare(prefix_sql)
+        # monthly partitions of time-series tables
+        await self.partitions.maintain()
+        self.partitions.start()
 
-        # guild settings statement
-        self.settings_conn = await self.pool.acquire()
-        settings_sql = ('SELECT config_value FROM guild_config '
-                        'WHERE guild_id=$1 AND config_name=$2;')
-        self.settings_stmt = await self.settings_conn.prepare(settings_sql)
+        # table columns and primary keys
+        await self.schema.load()
+
+        # guild prefix cache
+        await self.load_prefixes()
+        if self.prefix_notify:
+            await self._listen()
+
+    async def _listen(self):
+        self.listen_conn = await self.pool.acquire()
+        await self.listen_conn.add_listener(
+            PREFIX_CHANNEL, self._on_prefix_notify)
+
+    async def _resync_prefixes(self):
+        # notifications sent while disconnected were missed
+        try:
+            await self._listen()
+            await self.load_prefixes()
+        except asyncpg.PostgresError as e:
+            self.log.exception(type(e).__name__, exc_info=e)
 
     async def core_tables_exist(self):
-        core_sql = core_table_sqls()
-        for k, v in core_sql.items():
-            table_exists = await self.table(k).exists()
-            if not table_exists:
-                self.log.warning(f'Core table {k} not found. Creating...')
-                await self.execute_transaction(v)
-                self.log.warning(f'Core table {k} created.')
+        # a new rollup counts the messages logged before it existed
+        created = await self.bootstrap_tables(
+            core_table_sqls(), core_indexes(),
+            {'message_counts': MESSAGE_COUNTS_BACKFILL})
+        for name in created:
+            self.log.warning(f'Core table {name} not found and was created.')
+        if 'member_activity' not in created:
+            await self.migrate_member_activity()
+
+    async def migrate_member_activity(self):
+        """Update a member_activity table from before milliseconds.
+
+        It was keyed on ``(member_id, time)`` with time in unix seconds.
+        The key now includes ``guild_id``, since the same member changes
+        in every guild they share with the bot at once, and times are in
+        milliseconds. Old rows are converted in one transaction.
+
+        Monthly partitions made for seconds are bounded wrongly for
+        milliseconds, so their rows are moved into new partitions.
+        """
+        table = 'member_activity'
+        rcrds = await self.execute_query(PRIMARY_KEY_SQL, table)
+        if not rcrds or 'guild_id' in rcrds[0]['definition']:
+            return
+        self.log.warning(f'Migrating {table} to millisecond times.')
+        columns = ('member_id, time, status, from_status, guild_id, '
+                   'display_name')
+        # partitions made after the switch already hold milliseconds
+        converted = (f'member_id, CASE WHEN time < {SECONDS_BEFORE} '
+                     f'THEN time * 1000 ELSE time END, status, from_status, '
+                     f'coalesce(guild_id, 0), display_name')
+        old_months = []
+        if await self.partitions.is_partitioned(table):
+            old_months = await self.partitions.partitions(table)
+        old_names = [self.partitions.partition_name(table, *m)
+                     for m in old_months]
+
+        statements = []
+        for name in old_names:
+            statements += [
+                f'ALTER TABLE {table} DETACH PARTITION {name};',
+                f'ALTER TABLE {name} RENAME TO {name}_seconds;']
+        statements.append(
+            f'ALTER TABLE {table} DROP CONSTRAINT {table}_pkey;')
+        # made before the default partition's rows move into them
+        statements += [self.partitions.partition_sql(table, *m)
+                       for m in old_months]
+        statements.append(
+            f'UPDATE {table} SET time = time * 1000 '
+            f'WHERE time < {SECONDS_BEFORE};')
+        for name in old_names:
+            statements += [
+                f'INSERT INTO {table} ({columns}) '
+                f'SELECT {converted} FROM {name}_seconds;',
+                f'DROP TABLE {name}_seconds;']
+        statements += [
+            # rows were always logged with a guild, but the column allowed
+            # null and is now part of the key
+            f'UPDATE {table} SET guild_id = 0 WHERE guild_id IS NULL;',
+            f'ALTER TABLE {table} ALTER COLUMN guild_id SET NOT NULL;',
+            f'ALTER TABLE {table} ADD CONSTRAINT {table}_pkey '
+            f'PRIMARY KEY (guild_id, member_id, time);']
+        await self.execute_batch((sql, ()) for sql in statements)
+        self.schema.invalidate()
+
+    async def existing_tables(self, names):
+        """Returns the set of the given table names that exist."""
+        sql = ('SELECT name FROM unnest($1::text[]) AS name '
+               'WHERE to_regclass(name) IS NOT NULL;')
+        rcrds = await self.execute_query(sql, list(names))
+        return {r['name'] for r in rcrds}
+
+    async def estimate_rows(self, table):
+        """Returns the planner's row estimate for a table.
+
+        Partitions are included. Unlike ``COUNT(*)`` this reads only the
+        catalog, so it costs the same no matter how large the table is.
+        """
+        sql = ('SELECT coalesce(sum(greatest(c.reltuples, 0)), 0)::bigint '
+               'AS estimate FROM pg_catalog.pg_class c '
+               'WHERE c.oid = to_regclass($1) OR c.oid IN ('
+               'SELECT inhrelid FROM pg_catalog.pg_inherits '
+               'WHERE inhparent = to_regclass($1));')
+        rcrds = await self.execute_query(sql, str(table), read=True)
+        return rcrds[0]['estimate']
+
+    async def bootstrap_tables(self, tables, indexes=None, populate=None):
+        """Create any of the given tables that don't exist yet.
+
+        Takes a dict of table names to their ``CREATE TABLE`` SQL. Calls
+        made in the same loop iteration are combined, so all pending
+        tables are checked with one catalog query and the missing ones
+        are created in one transaction.
+
+        ``populate`` is a dict of table names to SQL that fills a table
+        once created. It runs in the same transaction after all the
+        creates, so a table is never left created but unfilled.
+
+        ``indexes`` is a dict of table names to lists of
+        :class:`~.schema.Index`. Indexes of created tables are built
+        before returning, while those of existing tables are built in the
+        background so a large table doesn't hold up startup.
+
+        Returns the names of the given tables that were created.
+        """
+        self._pending_tables.update(tables)
+        self._pending_populate.update(populate or {})
+        for name, sqls in (indexes or {}).items():
+            self._pending_indexes.setdefault(name, []).extend(sqls)
+        if not self._bootstrap_task:
+            self._bootstrap_task = asyncio.ensure_future(
+                self._bootstrap(), loop=self.loop)
+        task = self._bootstrap_task
+        created = await asyncio.shield(task)
+        return [name for name in tables if name in created]
+
+    async def _bootstrap(self):
+        tables, self._pending_tables = self._pending_tables, {}
+        indexes, self._pending_indexes = self._pending_indexes, {}
+        populate, self._pending_populate = self._pending_populate, {}
+        self._bootstrap_task = None
+        existing = await self.existing_tables(tables)
+        missing = [name for name in tables if name not in existing]
+        if missing:
+            statements = [(tables[name], ()) for name in missing]
+            statements.extend(
+                (populate[name], ()) for name in missing if name in populate)
+            await self.execute_batch(statements)
+            self.schema.invalidate()
+            await self.create_indexes(
+                {n: indexes.pop(n) for n in missing if n in indexes})
+        if indexes:
+            asyncio.ensure_future(self.create_indexes(indexes), loop=self.loop)
+        return set(missing)
+
+    async def create_indexes(self, indexes):
+        """Build any missing indexes, one at a time.
+
+        Takes a dict of table names to lists of :class:`~.schema.Index`.
+        Indexes on plain tables are built ``CONCURRENTLY`` so writes
+        aren't blocked, which partitioned tables don't support. This is
+        decided from the table's kind in the catalog, so a table that is
+        still waiting to be migrated to partitions is treated as plain.
+
+        A failed concurrent build leaves an invalid index behind, which
+        ``IF NOT EXISTS`` would skip forever, so any invalid ones are
+        dropped and built again. A failed build is logged and the rest
+        carry on.
+        """
+        indexes = {name: idxs for name, idxs in indexes.items() if idxs}
+        if not indexes:
+            return
+        rcrds = await self.execute_query(INDEX_STATE_SQL, list(indexes))
+        for rcrd in rcrds:
+            table = rcrd['name']
+            concurrently = rcrd['relkind'] != 'p'
+            invalid = set(rcrd['invalid'])
+            for index in indexes[table]:
+                name = index.index_name(table)
+                if name in invalid:
+                    self.log.warning(f'Rebuilding invalid index {name}.')
+                    await self._run_index_sql(
+                        self._drop_index_sql(name, concurrently))
+                if not await self._run_index_sql(
+                        index.sql(table, concurrently=concurrently)):
+                    if concurrently:
+                        await self._run_index_sql(
+                            self._drop_index_sql(name, concurrently))
+
+    @staticmethod
+    def _drop_index_sql(name, concurrently):
+        if concurrently:
+            return f'DROP INDEX CONCURRENTLY IF EXISTS {name};'
+        return f'DROP INDEX IF EXISTS {name};'
+
+    async def _run_index_sql(self, sql):
+        # index builds run on their own outside a transaction, as
+        # CONCURRENTLY requires
+        try:
+            await self._execute(
+                lambda conn: conn.execute(sql), retry=False, statement=sql)
+        except asyncpg.PostgresError as e:
+            self.log.exception(
+                f'Index statement failed: {type(e).__name__}', exc_info=e)
+            return False
+        return True
 
     async def stop(self):
-        conns = (self.prefix_conn, self.settings_conn)
-        for c in conns:
-            if c:
-                await self.pool.release(c)
+        await self.partitions.stop()
+        for writer in self.writers:
+            await writer.stop()
+        if self.listen_conn:
+            await self.listen_conn.remove_listener(
+                PREFIX_CHANNEL, self._on_prefix_notify)
+            await self.pool.release(self.listen_conn)
         if self.pool:
             await self.pool.close()
             self.pool.terminate()
+        for pool in self.read_pools:
+            await pool.close()
+
+    async def load_prefixes(self):
+        """Load all guild prefixes into the prefix cache."""
+        rcrds = await self.execute_named('prefixes')
+        self.prefixes = {r['guild_id']: r['prefix'] for r in rcrds}
+
+    async def prefix_changed(self, guild_id, prefix=None):
+        """Update the cached prefix of a guild after it's been written.
+
+        A prefix of ``None`` means the guild is back to the default.
+        """
+        self._cache_prefix(guild_id, prefix)
+        if self.prefix_notify:
+            payload = json.dumps(dict(guild_id=guild_id, prefix=prefix))
+            await self.execute_query(
+                'SELECT pg_notify($1, $2);', PREFIX_CHANNEL, payload)
+
+    def _cache_prefix(self, guild_id, prefix):
+        if prefix:
+            self.prefixes[guild_id] = prefix
+        else:
+            self.prefixes.pop(guild_id, None)
+
+    def _on_prefix_notify(self, conn, pid, channel, payload):
+        data = json.loads(payload)
+        self._cache_prefix(data['guild_id'], data['prefix'])
 
     async def prefix_manager(self, bot, message):
         """Returns the bot prefixes by context.
@@ -77,64 +582,181 @@ class DatabaseInterface:
         Returns a guild-specific prefix if it has been set. If not,
         returns the default prefix.
 
-        Uses a prepared statement to ensure caching.
+        Prefixes are read from the in-memory cache, so no database
+        query is made per message.
         """
         default_prefix = bot.default_prefix
         if message.guild:
-            g_prefix = await self.prefix_stmt.fetchval(message.guild.id)
+            g_prefix = self.prefixes.get(message.guild.id)
             prefix = g_prefix if g_prefix else default_prefix
         else:
             prefix = default_prefix
 
         return when_mentioned_or(prefix)(bot, message)
 
-    async def execute_query(self, query, *query_args):
-        result = []
-        try:
-            async with self.pool.acquire() as conn:
-                stmt = await conn.prepare(query)
-                rcrds = await stmt.fetch(*query_args)
-                for rcrd in rcrds:
-                    result.append(rcrd)
-            return result
-        except asyncpg.exceptions.InterfaceError as e:
-            self.log.error(f'Exception {type(e)}: {e}')
-            await self.recreate_pool()
-            return await self.execute_query(query, *query_args)
+    async def execute_query(self, query, *query_args, read=False):
+        """Run a query and return all records.
+
+        Statements are prepared through the connection's statement cache,
+        so SQL rendered from the same query shape is only parsed and
+        planned once per pooled connection. With ``read`` set, the query
+        is sent to a read replica if there are any.
+        """
+        async def run(conn):
+            return list(await conn.fetch(query, *query_args))
+
+        if read and self.read_pools:
+            return await self._execute_read(run, query)
+        return await self._execute(run, statement=query)
 
     async def execute_transaction(self, query, *query_args):
-        result = []
-        try:
-            async with self.pool.acquire() as conn:
-                stmt = await conn.prepare(query)
+        async def run(conn):
+            result = []
+            if any(isinstance(x, (set, tuple)) for x in query_args):
+                async with conn.transaction():
+                    for query_arg in query_args:
+                        async for rcrd in conn.cursor(query, *query_arg):
+                            result.append(rcrd)
+            else:
+                async with conn.transaction():
+                    async for rcrd in conn.cursor(query, *query_args):
+                        result.append(rcrd)
+            return result
 
-                if any(isinstance(x, (set, tuple)) for x in query_args):
-                    async with conn.transaction():
-                        for query_arg in query_args:
-                            async for rcrd in stmt.cursor(*query_arg):
-                                result.append(rcrd)
-                else:
+        return await self._execute(run, retry=False, statement=query)
+
+    async def execute_stream(self, query, *query_args, batch_size=500,
+                             read=False):
+        """Yield records from a query through a server-side cursor.
+
+        Records are fetched ``batch_size`` at a time inside a transaction,
+        so memory use doesn't grow with the size of the result. A pooled
+        connection is held until the iteration finishes. With ``read``
+        set, the query is sent to a read replica if there are any.
+        """
+        pool = self.read_pool() if read else None
+        if pool is not None:
+            yielded = False
+            self._busy[pool] += 1
+            try:
+                async with pool.acquire() as conn:
                     async with conn.transaction():
-                        async for rcrd in stmt.cursor(*query_args):
-                            result.append(rcrd)
-                return result
-        except asyncpg.exceptions.InterfaceError:
-            await self.recreate_pool()
-            return await self.execute_query(query, *query_args)
+                        cursor = conn.cursor(
+                            query, *query_args, prefetch=batch_size)
+                        async for rcrd in cursor:
+                            yielded = True
+                            yield rcrd
+            except Exception as e:
+                if not self._is_disconnect(e, pool):
+                    self.read_breakers[pool].record_success()
+                    raise
+                self._replica_failed(pool, e)
+                if yielded:
+                    # records were already yielded, so don't run it again
+                    raise DatabaseUnavailableError(str(e)) from e
+            else:
+                self.read_breakers[pool].record_success()
+                return
+            finally:
+                self._busy[pool] -= 1
+        self.breaker.check()
+        pool = self.pool
+        try:
+            async with pool.acquire() as conn:
+                async with conn.transaction():
+                    cursor = conn.cursor(
+                        query, *query_args, prefetch=batch_size)
+                    async for rcrd in cursor:
+                        yield rcrd
+        except Exception as e:
+            if not self._is_disconnect(e, pool):
+                self.breaker.record_success()
+                raise
+            self.log.error(f'Exception {type(e)}: {e}')
+            self.breaker.record_failure()
+            # records may already have been yielded, so don't run it again
+            await self.reconnect(pool)
+            raise DatabaseUnavailableError(str(e)) from e
+        else:
+            self.breaker.record_success()
+
+    async def execute_many(self, query, query_args):
+        """Run a statement once for each set of args in one transaction.
+
+        The statement is prepared once and the args are pipelined, so bulk
+        data costs a single round trip. No records are returned.
+        """
+        async def run(conn):
+            async with conn.transaction():
+                await conn.executemany(query, query_args)
+            return []
+
+        return await self._execute(run, retry=False, statement=query)
+
+    async def execute_batch(self, statements):
+        """Run several statements in one transaction.
+
+        Takes an iterable of ``(query, args)`` pairs and returns the
+        records from all of them in order.
+        """
+        statements = list(statements)
+
+        async def run(conn):
+            result = []
+            async with conn.transaction():
+                for query, query_args in statements:
+                    result.extend(await conn.fetch(query, *query_args))
+            return result
+
+        shape = '; '.join(dict.fromkeys(query for query, __ in statements))
+        return await self._execute(run, retry=False, statement=shape)
+
+    async def execute_in_transaction(self, func, *, statement=None):
+        """Run coroutine function ``func`` with a connection in a transaction.
+
+        Everything ``func`` runs on the connection it's given is committed
+        together, or not at all if it raises. Like other writes, it isn't
+        run again if the connection is lost part way through.
+        """
+        async def run(conn):
+            async with conn.transaction():
+                return await func(conn)
+
+        return await self._execute(run, retry=False, statement=statement)
+
+    async def execute_copy(self, table, records, columns):
+        async def run(conn):
+            return await conn.copy_records_to_table(
+                table, records=records, columns=columns)
+
+        return await self._execute(
+            run, retry=False, statement=f"COPY {table} ({', '.join(columns)})")
+
+    def batch_writer(self, table, columns, **kwargs):
+        """Create a buffered bulk writer for a table.
+
+        Writers are flushed and stopped along with the interface.
+        """
+        writer = BatchWriter(self, table, columns, **kwargs)
+        self.writers.append(writer)
+        return writer
 
     async def create_table(self, name, columns: list, *, primaries=None):
         """Create table."""
-        return await Table(self, name).create(columns, primaries=primaries)
+        return await self.table(name).create(*columns, primaries=primaries)
 
     def table(self, name):
-        return Table(name, self)
+        """Returns the shared handle for a table."""
+        table = self._tables.get(name)
+        if table is None:
+            table = self._tables[name] = Table(name, self)
+        return table
 
     def query(self, tables):
-        tables = [Table(self, name) for name in tables]
-        return Query(self, tables)
+        return Query(self).table(*tables)
 
     def insert(self, table):
         return Insert(self, table)
 
     def update(self, table):
-        return Query(self, table)
+        return Update(self, table)
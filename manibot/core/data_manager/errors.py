@@ -8,3 +8,6 @@ class ResponseError(PostgresError):
 
 class QueryError(PostgresError):
     pass
+
+class DatabaseUnavailableError(PostgresError):
+    pass
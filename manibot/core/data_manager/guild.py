@@ -10,23 +10,29 @@ class GuildDM:
         self.guild_id = int(guild)
 
     async def settings(self, key=None, value=None, *, delete=False):
-        config_table = self.dbi.table('guild_config')
+        """Get, set and delete guild settings.
+
+        Reads are served from the settings cache on the interface.
+        Calling without args returns all settings as a dict.
+        """
+        cache = self.dbi.settings
         if delete:
             if key:
-                return await config_table.delete(
-                    guild_id=self.guild_id, config_name=str(key))
+                return await cache.delete(self.guild_id, str(key))
             else:
                 return None
         if key is not None:
             if value is not None:
-                return await config_table.upsert(
-                    guild_id=self.guild_id,
-                    config_name=str(key), config_value=str(value))
+                return await cache.set(self.guild_id, str(key), str(value))
             else:
-                return await self.dbi.settings_stmt.fetchval(
-                    self.guild_id, str(key))
+                return await cache.get(self.guild_id, str(key))
         else:
-            return await config_table.get(guild_id=self.guild_id)
+            return dict(await cache.guild(self.guild_id))
+
+    async def settings_many(self, *keys):
+        """Get several guild settings at once as a dict."""
+        return await self.dbi.settings.get_many(
+            self.guild_id, *(str(k) for k in keys))
 
     async def prefix(self, new_prefix: str = None):
         """Add, remove and change custom guild prefix.
@@ -35,13 +41,16 @@ class GuildDM:
         Set new prefix by calling with the new prefix as an arg.
         Reset prefix to default by calling 'reset' as an arg.
         """
+        if not new_prefix:
+            return self.dbi.prefixes.get(self.guild_id)
         pfx_tbl = self.dbi.table('prefix')
-        pfx_tbl.query.where(guild_id=self.guild_id)
-        if new_prefix:
-            if new_prefix.lower() == "reset":
-                return await pfx_tbl.query.delete()
-            pfx_tbl.insert(guild_id=self.guild_id, prefix=new_prefix)
-            pfx_tbl.insert.primaries('guild_id')
-            return await pfx_tbl.insert.commit(do_update=True)
-        else:
-            return await pfx_tbl.query.get_value('prefix')
+        if new_prefix.lower() == "reset":
+            query = pfx_tbl.query.where(guild_id=self.guild_id)
+            result = await query.delete()
+            await self.dbi.prefix_changed(self.guild_id)
+            return result
+        insert = pfx_tbl.insert(guild_id=self.guild_id, prefix=new_prefix)
+        insert.primaries('guild_id')
+        result = await insert.commit(do_update=True)
+        await self.dbi.prefix_changed(self.guild_id, new_prefix)
+        return result
@@ -0,0 +1,140 @@
+import logging
+import time
+
+# upper bounds in milliseconds of the latency histogram buckets
+LATENCY_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+# statements past the limit are counted together under this key
+OTHER_STATEMENTS = '<other>'
+
+
+class StatementStats:
+    """Running totals for one statement shape.
+
+    Times are in milliseconds. ``buckets`` counts calls per latency
+    bucket, with the last one holding calls slower than every bound in
+    :data:`LATENCY_BUCKETS`.
+    """
+
+    __slots__ = ('statement', 'calls', 'errors', 'rows', 'total_time',
+                 'max_time', 'wait_time', 'buckets')
+
+    def __init__(self, statement):
+        self.statement = statement
+        self.calls = 0
+        self.errors = 0
+        self.rows = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.wait_time = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    @property
+    def mean_time(self):
+        return self.total_time / self.calls if self.calls else 0.0
+
+    def percentile(self, pct):
+        """Returns the bucket bound that ``pct`` percent of calls are under.
+
+        Returns ``None`` if that falls in the unbounded last bucket.
+        """
+        target = self.calls * pct / 100
+        seen = 0
+        for bound, count in zip(LATENCY_BUCKETS, self.buckets):
+            seen += count
+            if seen >= target:
+                return bound
+        return None
+
+    def record(self, wait, elapsed, rows, error):
+        self.calls += 1
+        self.wait_time += wait
+        self.total_time += elapsed
+        self.max_time = max(self.max_time, elapsed)
+        if error:
+            self.errors += 1
+        if rows:
+            self.rows += rows
+        for index, bound in enumerate(LATENCY_BUCKETS):
+            if elapsed <= bound:
+                break
+        else:
+            index = len(LATENCY_BUCKETS)
+        self.buckets[index] += 1
+
+
+class QueryTimer:
+    """Times a single database call for :class:`QueryStats`."""
+
+    __slots__ = ('stats', 'statement', 'started', 'acquired_at')
+
+    def __init__(self, stats, statement):
+        self.stats = stats
+        self.statement = statement
+        self.started = time.perf_counter()
+        self.acquired_at = None
+
+    def acquired(self):
+        """Mark when a pooled connection was handed over."""
+        self.acquired_at = time.perf_counter()
+
+    def done(self, result=None, *, error=False):
+        now = time.perf_counter()
+        acquired_at = self.acquired_at or now
+        wait = (acquired_at - self.started) * 1000
+        elapsed = (now - acquired_at) * 1000
+        rows = len(result) if isinstance(result, list) else None
+        self.stats.record(self.statement, wait, elapsed, rows, error)
+
+
+class QueryStats:
+    """Latency, row and error counts per statement shape.
+
+    SQL rendered by the query builders only differs by its bound values,
+    so the SQL text identifies the shape. Statements slower than
+    ``slow_ms`` are logged to ``manibot.core.dbi.slow``.
+
+    Parameters
+    -----------
+    slow_ms: :class:`float`
+        Milliseconds after which a statement is logged as slow, or
+        ``None`` to not log slow statements.
+    max_statements: :class:`int`
+        Number of distinct statements tracked. Any more are counted
+        together as ``<other>``.
+    """
+
+    def __init__(self, *, slow_ms=500, max_statements=1000):
+        self.slow_ms = slow_ms
+        self.max_statements = max_statements
+        self.statements = {}
+        self.since = time.time()
+        self.slow_log = logging.getLogger('manibot.core.dbi.slow')
+
+    def timer(self, statement):
+        return QueryTimer(self, statement)
+
+    def record(self, statement, wait, elapsed, rows=None, error=False):
+        statement = statement or OTHER_STATEMENTS
+        stats = self.statements.get(statement)
+        if stats is None:
+            if len(self.statements) >= self.max_statements:
+                statement = OTHER_STATEMENTS
+            stats = self.statements.get(statement)
+            if stats is None:
+                stats = self.statements[statement] = StatementStats(statement)
+        stats.record(wait, elapsed, rows, error)
+        if self.slow_ms is not None and elapsed >= self.slow_ms:
+            rows = '?' if rows is None else rows
+            self.slow_log.warning(
+                f'{elapsed:.0f} ms (waited {wait:.0f} ms, {rows} rows): '
+                f'{" ".join(statement.split())}')
+
+    def top(self, count=10, key='total_time'):
+        """Returns the statements with the highest value of ``key``."""
+        return sorted(self.statements.values(),
+                      key=lambda s: getattr(s, key), reverse=True)[:count]
+
+    def reset(self):
+        self.statements.clear()
+        self.since = time.time()
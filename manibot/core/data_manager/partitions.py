@@ -0,0 +1,188 @@
+import asyncio
+import logging
+import re
+from datetime import datetime, timezone
+
+import asyncpg
+
+PARTITIONS_SQL = """
+SELECT c.relname AS name
+FROM pg_catalog.pg_inherits i
+JOIN pg_catalog.pg_class c ON c.oid = i.inhrelid
+WHERE i.inhparent = to_regclass($1);
+"""
+
+RELKIND_SQL = ("SELECT relkind FROM pg_catalog.pg_class "
+               "WHERE oid = to_regclass($1);")
+
+
+def add_months(year, month, count):
+    """Returns the ``(year, month)`` that is ``count`` months away."""
+    index = year * 12 + month - 1 + count
+    return index // 12, index % 12 + 1
+
+
+def month_start(year, month, scale=1):
+    """Returns the unix time of the start of a month, times ``scale``."""
+    start = datetime(year, month, 1, tzinfo=timezone.utc)
+    return int(start.timestamp()) * scale
+
+
+class PartitionManager:
+    """Keeps monthly range partitions of time-series tables in step.
+
+    Each registered table is partitioned by range on a unix time column,
+    with one partition per month named like ``discord_messages_p2024_01``
+    and a default partition that catches anything outside them.
+    :meth:`maintain` creates the partitions for the current and upcoming
+    months and, if a retention is set, drops or detaches partitions older
+    than it, which removes a whole month without a ``DELETE``.
+
+    Parameters
+    -----------
+    dbi: :class:`DatabaseInterface`
+        The interface used to run the maintenance statements.
+    months_ahead: :class:`int`
+        Number of months after the current one to create in advance.
+    retention_months: :class:`int`
+        Number of past months to keep, or ``None`` to keep everything.
+    detach: :class:`bool`
+        Detach expired partitions instead of dropping them, leaving them
+        as standalone tables to archive.
+    interval: :class:`float`
+        Seconds between background maintenance runs.
+    """
+
+    def __init__(self, dbi, *, months_ahead=2, retention_months=None,
+                 detach=False, interval=21600):
+        self.dbi = dbi
+        self.months_ahead = months_ahead
+        self.retention_months = retention_months
+        self.detach = detach
+        self.interval = interval
+        self.tables = {}
+        self.logger = logging.getLogger('manibot.core.dbi.PartitionManager')
+        self._task = None
+        self._closing = asyncio.Event()
+
+    def register(self, table, column, *, scale=1):
+        """Manage monthly partitions of a table on a unix time column.
+
+        ``scale`` is the number of column units per second, such as
+        ``1000`` for milliseconds.
+        """
+        self.tables[str(table)] = (column, scale)
+
+    @staticmethod
+    def partition_name(table, year, month):
+        return f'{table}_p{year:04d}_{month:02d}'
+
+    def partition_sql(self, table, year, month):
+        """Returns the SQL creating the partition of a month."""
+        __, scale = self.tables[table]
+        lower = month_start(year, month, scale)
+        upper = month_start(*add_months(year, month, 1), scale)
+        name = self.partition_name(table, year, month)
+        return (f'CREATE TABLE IF NOT EXISTS {name} PARTITION OF {table} '
+                f'FOR VALUES FROM ({lower}) TO ({upper});')
+
+    def _parse_name(self, table, name):
+        match = re.fullmatch(rf'{re.escape(table)}_p(\d{{4}})_(\d{{2}})', name)
+        if match:
+            return int(match.group(1)), int(match.group(2))
+        return None
+
+    async def is_partitioned(self, table):
+        rcrds = await self.dbi.execute_query(RELKIND_SQL, table)
+        return bool(rcrds) and rcrds[0]['relkind'] == 'p'
+
+    async def partitions(self, table):
+        """Returns the ``(year, month)`` of each monthly partition."""
+        rcrds = await self.dbi.execute_query(PARTITIONS_SQL, table)
+        months = (self._parse_name(table, r['name']) for r in rcrds)
+        return sorted(m for m in months if m)
+
+    async def ensure(self, table):
+        """Create the default partition and any missing upcoming months."""
+        existing = set(await self.partitions(table))
+        statements = [
+            f'CREATE TABLE IF NOT EXISTS {table}_default '
+            f'PARTITION OF {table} DEFAULT;']
+        now = datetime.utcnow()
+        for offset in range(self.months_ahead + 1):
+            year, month = add_months(now.year, now.month, offset)
+            if (year, month) in existing:
+                continue
+            statements.append(self.partition_sql(table, year, month))
+        for sql in statements:
+            try:
+                await self.dbi.execute_query(sql)
+            except asyncpg.PostgresError as e:
+                # usually rows for the month already sit in the default
+                self.logger.exception(
+                    f'Partition for {table} not created: {type(e).__name__}',
+                    exc_info=e)
+
+    async def expire(self, table):
+        """Drop or detach monthly partitions past the retention period.
+
+        Returns the names of the partitions removed.
+        """
+        if not self.retention_months:
+            return []
+        now = datetime.utcnow()
+        cutoff = add_months(now.year, now.month, -self.retention_months)
+        expired = []
+        for year, month in await self.partitions(table):
+            if (year, month) >= cutoff:
+                continue
+            name = self.partition_name(table, year, month)
+            if self.detach:
+                sql = f'ALTER TABLE {table} DETACH PARTITION {name};'
+            else:
+                sql = f'DROP TABLE {name};'
+            await self.dbi.execute_query(sql)
+            expired.append(name)
+        if expired:
+            action = 'Detached' if self.detach else 'Dropped'
+            self.logger.info(
+                f"{action} expired partitions: {', '.join(expired)}")
+        return expired
+
+    async def maintain(self):
+        """Create upcoming partitions and expire old ones for all tables."""
+        for table in self.tables:
+            if not await self.is_partitioned(table):
+                # created before partitioning, left as a plain table
+                self.logger.warning(
+                    f'Table {table} is not partitioned, skipping.')
+                continue
+            await self.ensure(table)
+            await self.expire(table)
+        self.dbi.schema.invalidate()
+
+    def start(self):
+        if self._task is not None and not self._task.done():
+            return False
+        self._closing.clear()
+        self._task = asyncio.ensure_future(self._run(), loop=self.dbi.loop)
+        return True
+
+    async def _run(self):
+        while not self._closing.is_set():
+            try:
+                await asyncio.wait_for(self._closing.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            else:
+                break
+            try:
+                await self.maintain()
+            except (asyncpg.PostgresError, OSError) as e:
+                self.logger.exception(type(e).__name__, exc_info=e)
+
+    async def stop(self):
+        self._closing.set()
+        if self._task:
+            await self._task
+            self._task = None
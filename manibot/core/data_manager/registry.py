@@ -0,0 +1,57 @@
+SCHEMA_SQL = """
+SELECT c.relname AS table_name, a.attname AS column_name,
+       coalesce(a.attnum = ANY(i.indkey), false) AS is_primary
+FROM pg_catalog.pg_class c
+JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+JOIN pg_catalog.pg_attribute a
+  ON a.attrelid = c.oid AND a.attnum > 0 AND NOT a.attisdropped
+LEFT JOIN pg_catalog.pg_index i ON i.indrelid = c.oid AND i.indisprimary
+WHERE n.nspname = current_schema() AND c.relkind IN ('r', 'p')
+ORDER BY c.relname, a.attnum;
+"""
+
+
+class SchemaRegistry:
+    """Column names and primary keys of every table in the database.
+
+    All tables are read from the system catalog in one query on first use
+    and kept in memory. Creating or dropping a table through
+    :class:`Table` marks the registry stale so it's read again on the next
+    lookup.
+    """
+
+    def __init__(self, dbi):
+        self.dbi = dbi
+        self._columns = {}
+        self._primaries = {}
+        self._loaded = False
+
+    async def load(self):
+        rcrds = await self.dbi.execute_query(SCHEMA_SQL)
+        columns = {}
+        primaries = {}
+        for r in rcrds:
+            columns.setdefault(r['table_name'], []).append(r['column_name'])
+            if r['is_primary']:
+                primaries.setdefault(
+                    r['table_name'], []).append(r['column_name'])
+        self._columns = {k: tuple(v) for k, v in columns.items()}
+        self._primaries = {k: tuple(v) for k, v in primaries.items()}
+        self._loaded = True
+
+    def invalidate(self):
+        self._loaded = False
+
+    async def _ensure_loaded(self, table):
+        if not self._loaded or str(table) not in self._columns:
+            await self.load()
+
+    async def columns(self, table):
+        """Returns the column names of a table."""
+        await self._ensure_loaded(table)
+        return self._columns.get(str(table), ())
+
+    async def primaries(self, table):
+        """Returns the primary key column names of a table."""
+        await self._ensure_loaded(table)
+        return self._primaries.get(str(table), ())
@@ -1,9 +1,22 @@
+import base64
+import json
+import re
+from datetime import datetime
+from functools import lru_cache
 from itertools import zip_longest, chain
+
+from dateutil.parser import parse as parse_datetime
 from more_itertools import partition
 
 from .errors import PostgresError, SchemaError, ResponseError, QueryError
 from . import sqltypes
 
+# postgres limit on bind parameters in a single statement
+MAX_QUERY_ARGS = 32767
+
+# number of rendered statement shapes kept per statement type
+SQL_CACHE_SIZE = 512
+
 class SQLOperator:
 
     default_template = '{column} {operator} {value}'
@@ -64,9 +77,15 @@ class SQLOperator:
         return cls(
             'BETWEEN', None, '{column} {operator} {minvalue} AND {maxvalue}')
 
+    @classmethod
+    def any_(cls):
+        return cls('= ANY', 'in', '{column} {operator}({value})')
+
     @classmethod
     def in_(cls):
-        return cls('IN', 'in', cls.default_template)
+        # a single array parameter keeps one statement shape for any
+        # number of values, where IN would need a parameter per value
+        return cls.any_()
 
     @classmethod
     def is_(cls):
@@ -99,10 +118,11 @@ class SQLComparison:
 
 class Column:
     __slots__ = ('name', 'data_type', 'primary_key', 'required',
-                 'default', 'unique', 'table', 'aggregate')
+                 'default', 'unique', 'index', 'table', 'aggregate')
 
     def __init__(self, name, data_type=None, *, primary_key=False,
-                 required=False, default=None, unique=False, table=None):
+                 required=False, default=None, unique=False, index=False,
+                 table=None):
         self.name = name
         if data_type:
             if not isinstance(data_type, sqltypes.SQLType):
@@ -112,6 +132,8 @@ class Column:
         self.required = required
         self.default = default
         self.unique = unique
+        # True for a default btree index, or the name of an index method
+        self.index = index
         if sum(map(bool, [primary_key, default is not None, unique])) > 1:
             raise SchemaError('Set only one of either primary_key, default or '
                               'unique')
@@ -169,9 +191,10 @@ class Column:
             SQLOperator.between(), self.aggregate, self.name,
             minvalue=minvalue, maxvalue=maxvalue)
 
-    def in_(self, value):
+    def in_(self, values):
+        """Match any of the values, bound as one array parameter."""
         return SQLComparison(
-            SQLOperator.in_(), self.aggregate, self.name, value)
+            SQLOperator.in_(), self.aggregate, self.name, list(values))
 
     @classmethod
     def from_dict(cls, data):
@@ -267,6 +290,66 @@ class IntervalColumn(Column):
     def __init__(self, name, field=False, **kwargs):
         super().__init__(name, sqltypes.IntervalSQL(field), **kwargs)
 
+
+class Index:
+    """Declares a secondary index on a table.
+
+    Parameters
+    -----------
+    *columns: :class:`Column` or :class:`str`
+        Columns or expressions to index, in order.
+    name: :class:`str`
+        Name of the index. Defaults to one made from the table and columns.
+    unique: :class:`bool`
+        Whether indexed values must be unique.
+    method: :class:`str`
+        Index method, such as ``'gin'`` for array or ``jsonb`` columns.
+    where: :class:`str`
+        Condition of a partial index, such as ``'is_edit = false'``.
+    """
+
+    __slots__ = ('columns', 'name', 'unique', 'method', 'where')
+
+    def __init__(self, *columns, name=None, unique=False, method=None,
+                 where=None):
+        if not columns:
+            raise SchemaError('An index needs at least one column.')
+        self.columns = [
+            col.name if isinstance(col, Column) else col for col in columns]
+        self.name = name
+        self.unique = unique
+        self.method = method
+        self.where = where
+
+    def index_name(self, table):
+        if self.name:
+            return self.name
+        columns = re.sub(r'\W+', '_', '_'.join(self.columns)).strip('_')
+        return f"{table}_{columns}_idx"
+
+    def sql(self, table, *, concurrently=True):
+        """Generate SQL for creating the index on a table.
+
+        Indexes are built ``CONCURRENTLY`` by default so writes to an
+        existing table aren't blocked. Partitioned tables don't support
+        that, so pass ``concurrently=False`` for them.
+        :meth:`DatabaseInterface.create_indexes` picks this for you.
+        """
+        sql = ['CREATE']
+        if self.unique:
+            sql.append('UNIQUE')
+        sql.append('INDEX')
+        if concurrently:
+            sql.append('CONCURRENTLY')
+        sql.append(f"IF NOT EXISTS {self.index_name(table)} ON {table}")
+        if self.method:
+            sql.append(f"USING {self.method}")
+        sql.append(f"({', '.join(self.columns)})")
+        if self.where:
+            sql.append(f"WHERE {self.where}")
+        return ' '.join(sql)
+
+
 class TableOld:
     """Represents a database table."""
 
@@ -398,31 +481,43 @@ class TableColumns:
         return Column(name, table=self._table)
 
     async def get_names(self):
-        metatable = Table('information_schema.columns', self._dbi)
-        metatable.query('column_name')
-        metatable.query.where(TABLE_NAME=self._table.name)
-        return await metatable.query.get_values()
+        return list(await self._dbi.schema.columns(self._table.name))
 
     async def get_primaries(self):
-        kcu = Table('information_schema.key_column_usage', self._dbi)
-        query = kcu.query('column_name').where(TABLE_NAME=self._table.name)
-        return await query.get_values()
+        return list(await self._dbi.schema.primaries(self._table.name))
 
 class Table:
-    """Represents a database table."""
+    """Represents a database table.
 
-    __slots__ = ('name', 'dbi', 'columns', 'where', 'new_columns',
-                 'query', 'insert', 'update')
+    Tables are lightweight handles, interned per name by
+    :meth:`DatabaseInterface.table`. The ``query``, ``insert`` and
+    ``update`` builders are created fresh on each access, so keep the
+    returned builder to add to it and run it.
+    """
+
+    __slots__ = ('name', 'dbi', 'new_columns', 'new_indexes')
 
     def __init__(self, name: str, dbi):
         self.name = name
         self.dbi = dbi
-        self.where = SQLConditions(parent=self)
-        self.columns = TableColumns(table=self)
         self.new_columns = []
-        self.query = Query(dbi, self)
-        self.insert = Insert(dbi, self)
-        self.update = Update(dbi, self)
+        self.new_indexes = []
+
+    @property
+    def columns(self):
+        return TableColumns(table=self)
+
+    @property
+    def query(self):
+        return Query(self.dbi, self)
+
+    @property
+    def insert(self):
+        return Insert(self.dbi, self)
+
+    @property
+    def update(self):
+        return Update(self.dbi, self)
 
     def __str__(self):
         return self.name
@@ -454,28 +549,44 @@ class Table:
         sql += ")"
         return sql
 
-    async def create(self, *columns, primaries=None):
-        """Create table and return the object representing it."""
-        sql = f"CREATE TABLE {self.name} ("
+    def sql_create(self, *columns, primaries=None):
+        """Generate SQL for creating this table."""
         if not columns:
             if not self.new_columns:
                 raise SchemaError("No columns for created table.")
             columns = self.new_columns
-        sql += ', '.join(col.to_sql for col in columns)
-        if not primaries:
-            primaries = [col.name for col in columns if col.primary_key]
-        if primaries:
-            if isinstance(primaries, str):
-                sql += f", CONSTRAINT {self.name}_pkey PRIMARY KEY ({primaries})"
-            elif isinstance(primaries, (list, tuple, set)):
-                sql += (f", CONSTRAINT {self.name}_pkey"
-                        f" PRIMARY KEY ({', '.join(primaries)})")
-        sql += ")"
+        return self.create_sql(self.name, *columns, primaries=primaries)
+
+    def table_indexes(self, *columns, indexes=None):
+        """Returns this table's secondary :class:`Index` declarations.
+
+        Includes the given or declared ``new_indexes`` and any columns
+        declared with ``index`` set.
+        """
+        columns = columns or self.new_columns
+        indexes = list(self.new_indexes if indexes is None else indexes)
+        for col in columns:
+            if col.index:
+                method = col.index if isinstance(col.index, str) else None
+                indexes.append(Index(col.name, method=method))
+        return indexes
+
+    def sql_indexes(self, *columns, indexes=None, concurrently=True):
+        """Generate SQL for creating this table's secondary indexes."""
+        indexes = self.table_indexes(*columns, indexes=indexes)
+        return [i.sql(self.name, concurrently=concurrently) for i in indexes]
+
+    async def create(self, *columns, primaries=None, indexes=None):
+        """Create table and return the object representing it."""
+        sql = self.sql_create(*columns, primaries=primaries)
         try:
             await self.dbi.execute_transaction(sql)
         except PostgresError:
             raise
         else:
+            self.dbi.schema.invalidate()
+            await self.dbi.create_indexes(
+                {self.name: self.table_indexes(*columns, indexes=indexes)})
             return self
 
     async def exists(self):
@@ -490,16 +601,18 @@ class Table:
 
     async def drop(self):
         """Drop table from database."""
-        sql = f"DROP TABLE $1"
-        return await self.dbi.execute_transaction(sql, (self.name,))
+        sql = f"DROP TABLE {self.name}"
+        result = await self.dbi.execute_transaction(sql)
+        self.dbi.schema.invalidate()
+        return result
 
     async def get_contraints(self):
         """Get column from table."""
-        table = Table('information_schema.table_constraints', self.dbi)
-        table.query('constrain_name').where(
-            TABLE_NAME=table,
-            CONSTRAINT_TYPE='PRIMARY KEY')
-        return await table.query.get_values()
+        table = self.dbi.table('information_schema.table_constraints')
+        query = table.query('constraint_name').where(
+            table_name=self.name,
+            constraint_type='PRIMARY KEY')
+        return await query.get_values()
 
 class SQLConditions:
     def __init__(self, parent=None, allow_having=True):
@@ -593,6 +706,44 @@ class SQLConditions:
             conditions = tuple(k_conds)
         return self.add_conditions(conditions)
 
+    def add_row_comparison(self, columns, operator, values):
+        """Compare several columns as a row, such as ``(a, b) > ($1, $2)``."""
+        params = []
+        for value in values:
+            params.append(f"${self._count}")
+            self.values.append(value)
+        self.where_conditions.append(
+            f"({', '.join(columns)}) {operator} ({', '.join(params)})")
+        return self._parent
+
+
+def encode_page_token(values):
+    """Encode keyset values into an opaque page token."""
+    def default(obj):
+        if isinstance(obj, datetime):
+            return {'$dt': obj.isoformat()}
+        raise TypeError(f"Can't encode {type(obj).__name__} in page token.")
+    data = json.dumps(values, default=default).encode()
+    return base64.urlsafe_b64encode(data).decode()
+
+
+def decode_page_token(token):
+    """Decode a page token back into its keyset values."""
+    def object_hook(obj):
+        if '$dt' in obj:
+            return parse_datetime(obj['$dt'])
+        return obj
+    try:
+        data = base64.urlsafe_b64decode(token.encode())
+        values = json.loads(data.decode(), object_hook=object_hook)
+    except ValueError:
+        raise QueryError('Invalid page token.')
+    # tokens come from users, so valid json of the wrong shape is possible
+    if not isinstance(values, list):
+        raise QueryError('Invalid page token.')
+    return values
+
+
 class Query:
     """Builds a database query."""
     def __init__(self, dbi, table=None):
@@ -601,12 +752,14 @@ class Query:
         self._distinct = False
         self._group_by = []
         self._order_by = []
+        self._order_keys = []
         self._sort = ''
         self._from = set()
         if table:
             self.table(table)
         self._limit = None
         self._offset = None
+        self._read = True
         self.conditions = SQLConditions(parent=self)
         self.where = self.conditions.add_conditions
         self.having = self.conditions.add_having
@@ -635,7 +788,7 @@ class Query:
             if isinstance(table, Table):
                 self._from.add(table)
             elif isinstance(table, str):
-                self._from.add(Table(table, self._dbi))
+                self._from.add(self._dbi.table(table))
             else:
                 type_given = type(table).__name__
                 raise SyntaxError(
@@ -660,10 +813,53 @@ class Query:
         for col in columns:
             if isinstance(col, Column):
                 self._order_by.append(f"{col.name}{sort}")
+                self._order_keys.append((col.name, asc is not False))
             elif isinstance(col, str):
                 self._order_by.append(f"{col}{sort}")
+                self._order_keys.append((col, asc is not False))
         return self
 
+    def _seek(self, values, forward):
+        if not self._order_keys:
+            raise QueryError("Keyset paging needs 'order_by' to be set.")
+        directions = {asc for __, asc in self._order_keys}
+        if len(directions) > 1:
+            raise QueryError(
+                "Keyset paging needs all 'order_by' columns sorted the "
+                "same direction.")
+        columns = [name for name, __ in self._order_keys]
+        if isinstance(values, str):
+            values = decode_page_token(values)
+        elif not isinstance(values, (list, tuple)):
+            values = [values[c] for c in columns]
+        if len(values) != len(columns):
+            raise QueryError(
+                f"Expected {len(columns)} keyset values, got {len(values)}.")
+        operator = '>' if directions.pop() is forward else '<'
+        return self.conditions.add_row_comparison(columns, operator, values)
+
+    def after(self, values):
+        """Only include rows after the given keyset position.
+
+        Takes a page token, a record or mapping with the ``order_by``
+        columns, or a list of their values in ``order_by`` order. Unlike
+        ``offset``, the cost of each page doesn't grow with how deep it
+        is, as long as the ``order_by`` columns are indexed.
+        """
+        return self._seek(values, forward=True)
+
+    def before(self, values):
+        """Only include rows before the given keyset position.
+
+        Takes the same values as :meth:`after`.
+        """
+        return self._seek(values, forward=False)
+
+    def page_token(self, record):
+        """Returns an opaque token for the keyset position of a record."""
+        return encode_page_token(
+            [record[name] for name, __ in self._order_keys])
+
     def limit(self, number=None):
         if not isinstance(number, (int, type(None))):
             raise TypeError("Method 'limit' only accepts an int argument.")
@@ -676,34 +872,26 @@ class Query:
         self._offset = number
         return self
 
+    def shape(self, delete=False):
+        """Returns a hashable key describing the structure of the query.
+
+        Queries with the same shape render the same SQL, differing only in
+        the values bound to it.
+        """
+        return (
+            delete,
+            self._distinct,
+            tuple(str(c) for c in self._select),
+            tuple(sorted(t.name for t in self._from)),
+            tuple(self.conditions.where_conditions),
+            tuple(self._group_by),
+            tuple(str(c) for c in self.conditions.having_conditions),
+            tuple(self._order_by),
+            self._limit,
+            self._offset)
+
     def sql(self, delete=False):
-        sql = []
-        if delete:
-            sql.append("DELETE")
-        else:
-            select_str = "SELECT DISTINCT" if self._distinct else "SELECT"
-            if not self._select:
-                sql.append(f"{select_str} *")
-            else:
-                select_names = [str(c) for c in self._select]
-                sql.append(f"{select_str} {', '.join(select_names)}")
-        table_names = [t.name for t in self._from]
-        sql.append(f"FROM {', '.join(table_names)}")
-        if self.conditions.where_conditions:
-            con_sql = self.conditions.where_conditions
-            sql.append(f"WHERE {' AND '.join(con_sql)}")
-        if self._group_by:
-            sql.append(f"GROUP BY {', '.join(self._group_by)}")
-        if self.conditions.having_conditions:
-            con_sql = self.conditions.having_conditions
-            sql.append(f"HAVING {' AND '.join(con_sql)}")
-        if self._order_by:
-            sql.append(f"ORDER BY {', '.join(self._order_by)}")
-        if self._limit:
-            sql.append(f"LIMIT {self._limit}")
-        if self._offset:
-            sql.append(f"OFFSET {self._offset}")
-        return (f"{' '.join(sql)};", self.conditions.values)
+        return (render_query(self.shape(delete)), self.conditions.values)
 
     async def delete(self, *conditions):
         if conditions:
@@ -711,9 +899,43 @@ class Query:
         query, args = self.sql(delete=True)
         return await self._dbi.execute_query(query, *args)
 
+    def use_primary(self, primary=True):
+        """Run the query on the primary database instead of a replica.
+
+        Use this when the query has to see writes that were just made,
+        as replicas can lag behind the primary.
+        """
+        self._read = not primary
+        return self
+
     async def get(self):
         query, args = self.sql()
-        return await self._dbi.execute_query(query, *args)
+        return await self._dbi.execute_query(query, *args, read=self._read)
+
+    async def get_page(self, size, after=None):
+        """Returns a page of records and the token for the next page.
+
+        The token is ``None`` when there are no more records.
+        """
+        if after is not None:
+            self.after(after)
+        self.limit(size)
+        data = await self.get()
+        token = self.page_token(data[-1]) if len(data) == size else None
+        return data, token
+
+    def stream(self, batch_size=500):
+        """Async iterator over the query's records, fetched in batches."""
+        query, args = self.sql()
+        return self._dbi.execute_stream(
+            query, *args, batch_size=batch_size, read=self._read)
+
+    async def stream_values(self, batch_size=500):
+        """Async iterator over the values of a single selected column."""
+        if not (len(self._select) == 1 or self._select == '*'):
+            raise QueryError("Query doesn't have a single column selected.")
+        async for row in self.stream(batch_size):
+            yield next(row.values())
 
     async def get_one(self):
         old_limit = self._limit
@@ -770,7 +992,7 @@ class Insert:
         if isinstance(table, Table):
             self._from = table
         elif isinstance(table, str):
-            self._from = Table(table, self._dbi)
+            self._from = self._dbi.table(table)
         else:
             type_given = type(table).__name__
             raise SyntaxError(
@@ -781,7 +1003,7 @@ class Insert:
         self._returning = columns
         return self
 
-    def sql(self, do_update=None):
+    def sql(self, do_update=None, row_count=1):
         """Build the SQL and sort data ready for dbi processing.
 
         Parameters:
@@ -793,18 +1015,18 @@ class Insert:
             already.
             `False` suppresses the exception and just does nothing when a
             duplicate is encountered.
+        row_count: :class:`int`
+            Number of rows in the ``VALUES`` list. With more than one,
+            each row's args follow on from the previous row's.
         """
 
         # get columns
-        cols = self._columns or set(chain.from_iterable(self._data))
+        cols = self._columns or sorted(set(chain.from_iterable(self._data)))
 
         # ensure all data entries have no missing keys
         if not self._columns:
             for entry in self._data:
-                entry.update((k, None) for k in cols - entry.keys())
-
-        # order columns and build column indexes
-        col_idx, cols = zip(*[(f"${i+1}", c) for i, c in enumerate(cols)])
+                entry.update((k, None) for k in set(cols) - entry.keys())
 
         # sort all data entries into in same order of columns
         data = []
@@ -812,26 +1034,12 @@ class Insert:
             entry_values = tuple(entry[d] for d in cols)
             data.append(entry_values)
 
-        # build the insert statement
-        col_str, idx_str = (', '.join(cols), ', '.join(col_idx))
-        sql = f"INSERT INTO {self._from} ({col_str}) VALUES ({idx_str})"
+        primaries = tuple(self._primaries) if do_update is not None else None
+        returning = tuple(self._returning) if self._returning else None
+        shape = (str(self._from), tuple(cols), row_count, do_update,
+                 primaries, returning)
 
-        # handle conflict if required
-        if do_update:
-            const_str = ', '.join(self._primaries)
-            sql += f" ON CONFLICT ({const_str}) DO UPDATE SET "
-            excluded = [f'{c} = excluded.{c}' for c in cols]
-            sql += ', '.join(excluded)
-
-        if do_update is False:
-            const_str = ', '.join(self._primaries)
-            sql += f" ON CONFLICT ({const_str}) DO NOTHING"
-
-        # add the returning statement if specified
-        if self._returning:
-            sql += f" RETURNING {', '.join(self._returning)}"
-
-        return (sql, tuple(data))
+        return (render_insert(shape), tuple(data))
 
     def sql_test(self, do_update=None):
         """SQL test output"""
@@ -858,7 +1066,31 @@ class Insert:
         if not do_update is None and not self._primaries:
             self._primaries = await self._from.columns.get_primaries()
         sql, data = self.sql(do_update)
-        return await self._dbi.execute_transaction(sql, *data)
+        if len(data) < 2:
+            return await self._dbi.execute_transaction(sql, *data)
+        if not self._returning:
+            return await self._dbi.execute_many(sql, data)
+
+        # returned rows are needed, so send multi-row statements instead
+        return await self._dbi.execute_batch(self.statements(do_update))
+
+    def statements(self, do_update=None):
+        """Build multi-row statements for the data in this insert.
+
+        Returns a list of ``(sql, args)`` pairs, each with as many rows as
+        fit under the query argument limit. ``do_update`` is as for
+        :meth:`commit`, but primaries must already be declared.
+        """
+        __, data = self.sql(do_update)
+        if not data:
+            return []
+        chunk_size = max(1, MAX_QUERY_ARGS // len(data[0]))
+        statements = []
+        for i in range(0, len(data), chunk_size):
+            chunk = data[i:i+chunk_size]
+            chunk_sql, __ = self.sql(do_update, row_count=len(chunk))
+            statements.append((chunk_sql, tuple(chain.from_iterable(chunk))))
+        return statements
 
     def set_columns(self, *columns):
         """Declares the columns for positional arg data entry."""
@@ -955,7 +1187,7 @@ class Update:
         if isinstance(table, Table):
             self._from = table
         elif isinstance(table, str):
-            self._from = Table(table, self._dbi)
+            self._from = self._dbi.table(table)
         else:
             type_given = type(table).__name__
             raise SyntaxError(
@@ -970,23 +1202,15 @@ class Update:
         """Build the SQL and sort data ready for dbi processing."""
 
         # get columns
-        cols = self._columns or set(chain.from_iterable(self._data))
+        cols = self._columns or sorted(set(chain.from_iterable(self._data)))
 
         # ensure all data entries have no missing keys
         if not self._columns:
             for entry in self._data:
-                entry.update((k, None) for k in cols - entry.keys())
-
-        # order columns and build column indexes
-        offset = 1
-        if self.conditions.where_conditions:
-            offset = self.conditions._count_token + 1
-        col_idx, cols = zip(*[(f"${i+offset}", c) for i, c in enumerate(cols)])
+                entry.update((k, None) for k in set(cols) - entry.keys())
 
         # build conditions
         if self.conditions.where_conditions:
-            conditions = self.conditions.where_conditions
-            cond_sql = f"WHERE {' AND '.join(conditions)}"
             cond_values = self.conditions.values
         else:
             if not allow_no_condition:
@@ -1002,22 +1226,12 @@ class Update:
             entry_values = tuple(cond_values + [entry[d] for d in cols])
             data.append(entry_values)
 
-        # build the insert statement
-        col_str, idx_str = (', '.join(cols), ', '.join(col_idx))
-        if len(cols) > 1:
-            sql = [f"UPDATE {self._from} SET ({col_str}) = ({idx_str})"]
-        else:
-            sql = [f"UPDATE {self._from} SET {col_str} = {idx_str}"]
-
-        # add conditions
-        if self.conditions.where_conditions:
-            sql.append(cond_sql)
-
-        # add the returning statement if specified
-        if self._returning:
-            sql.append(f"RETURNING {', '.join(self._returning)}")
+        returning = tuple(self._returning) if self._returning else None
+        shape = (str(self._from), tuple(cols),
+                 tuple(self.conditions.where_conditions),
+                 self.conditions._count_token, returning)
 
-        return (' '.join(sql), tuple(data))
+        return (render_update(shape), tuple(data))
 
     def sql_test(self, allow_no_condition=False):
         """SQL test output"""
@@ -1027,9 +1241,21 @@ class Update:
         return msg
 
     async def commit(self, allow_no_condition=False):
-        """Commit the data in the current update session to the database."""
+        """Commit the data in the current update session to the database.
+
+        Multiple value sets are pipelined in one round trip unless
+        ``returning`` is set. Every value set targets the same rows
+        through the shared conditions, so they can't be joined into a
+        single ``UPDATE ... FROM (VALUES ...)`` without changing which
+        rows each one matches. With ``returning``, each value set is a
+        separate statement, all in one transaction.
+        """
         sql, data = self.sql(allow_no_condition)
-        await self._dbi.execute_transaction(sql, *data)
+        if len(data) < 2:
+            return await self._dbi.execute_transaction(sql, *data)
+        if not self._returning:
+            return await self._dbi.execute_many(sql, data)
+        return await self._dbi.execute_batch([(sql, args) for args in data])
 
     def columns(self, *columns):
         if not columns:
@@ -1085,3 +1311,94 @@ class Update:
             self.values(**kwargs)
 
         return self
+
+
+@lru_cache(maxsize=SQL_CACHE_SIZE)
+def render_query(shape):
+    """Render the SQL for a :meth:`Query.shape`."""
+    (delete, distinct, select, tables, where, group_by, having,
+     order_by, limit, offset) = shape
+    sql = []
+    if delete:
+        sql.append("DELETE")
+    else:
+        select_str = "SELECT DISTINCT" if distinct else "SELECT"
+        if not select:
+            sql.append(f"{select_str} *")
+        else:
+            sql.append(f"{select_str} {', '.join(select)}")
+    sql.append(f"FROM {', '.join(tables)}")
+    if where:
+        sql.append(f"WHERE {' AND '.join(where)}")
+    if group_by:
+        sql.append(f"GROUP BY {', '.join(group_by)}")
+    if having:
+        sql.append(f"HAVING {' AND '.join(having)}")
+    if order_by:
+        sql.append(f"ORDER BY {', '.join(order_by)}")
+    if limit:
+        sql.append(f"LIMIT {limit}")
+    if offset:
+        sql.append(f"OFFSET {offset}")
+    return f"{' '.join(sql)};"
+
+
+@lru_cache(maxsize=SQL_CACHE_SIZE)
+def render_insert(shape):
+    """Render the SQL for an :class:`Insert` shape."""
+    table, cols, row_count, do_update, primaries, returning = shape
+
+    # build column indexes for each row
+    col_count = len(cols)
+    rows_idx = []
+    for r in range(row_count):
+        idx = (f"${r*col_count+i+1}" for i in range(col_count))
+        rows_idx.append(f"({', '.join(idx)})")
+
+    # build the insert statement
+    col_str, idx_str = (', '.join(cols), ', '.join(rows_idx))
+    sql = f"INSERT INTO {table} ({col_str}) VALUES {idx_str}"
+
+    # handle conflict if required
+    if do_update:
+        const_str = ', '.join(primaries)
+        sql += f" ON CONFLICT ({const_str}) DO UPDATE SET "
+        excluded = [f'{c} = excluded.{c}' for c in cols]
+        sql += ', '.join(excluded)
+
+    if do_update is False:
+        const_str = ', '.join(primaries)
+        sql += f" ON CONFLICT ({const_str}) DO NOTHING"
+
+    # add the returning statement if specified
+    if returning:
+        sql += f" RETURNING {', '.join(returning)}"
+
+    return sql
+
+
+@lru_cache(maxsize=SQL_CACHE_SIZE)
+def render_update(shape):
+    """Render the SQL for an :class:`Update` shape."""
+    table, cols, where, arg_count, returning = shape
+
+    # value indexes follow on from the condition args
+    offset = arg_count + 1 if where else 1
+    col_idx = [f"${i+offset}" for i in range(len(cols))]
+
+    # build the update statement
+    col_str, idx_str = (', '.join(cols), ', '.join(col_idx))
+    if len(cols) > 1:
+        sql = [f"UPDATE {table} SET ({col_str}) = ({idx_str})"]
+    else:
+        sql = [f"UPDATE {table} SET {col_str} = {idx_str}"]
+
+    # add conditions
+    if where:
+        sql.append(f"WHERE {' AND '.join(where)}")
+
+    # add the returning statement if specified
+    if returning:
+        sql.append(f"RETURNING {', '.join(returning)}")
+
+    return ' '.join(sql)
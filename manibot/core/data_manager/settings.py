@@ -0,0 +1,75 @@
+class SettingsCache:
+    """In-memory cache of guild settings from ``guild_config``.
+
+    The first read for a guild loads all of its settings in one query.
+    Later reads are served from memory, and writes update both the
+    database and the cached values.
+
+    Attributes
+    -----------
+    hits: :class:`int`
+        Reads served from the cache.
+    misses: :class:`int`
+        Reads that had to load the guild from the database.
+    """
+
+    def __init__(self, dbi):
+        self.dbi = dbi
+        self._guilds = {}
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def stats(self):
+        total = self.hits + self.misses
+        return dict(
+            hits=self.hits, misses=self.misses, guilds=len(self._guilds),
+            hit_rate=self.hits / total if total else None)
+
+    async def guild(self, guild_id):
+        """Returns all settings for a guild as a dict."""
+        config = self._guilds.get(guild_id)
+        if config is not None:
+            self.hits += 1
+            return config
+        self.misses += 1
+        rcrds = await self.dbi.execute_named('guild_config', guild_id)
+        config = {r['config_name']: r['config_value'] for r in rcrds}
+        self._guilds[guild_id] = config
+        return config
+
+    async def get(self, guild_id, key):
+        """Returns a single guild setting or ``None`` if not set."""
+        return (await self.guild(guild_id)).get(key)
+
+    async def get_many(self, guild_id, *keys):
+        """Returns a dict of the given settings, ``None`` for any not set."""
+        config = await self.guild(guild_id)
+        return {k: config.get(k) for k in keys}
+
+    async def set(self, guild_id, key, value):
+        table = self.dbi.table('guild_config')
+        insert = table.insert(
+            guild_id=guild_id, config_name=key, config_value=value)
+        insert.primaries('guild_id', 'config_name')
+        result = await insert.commit(do_update=True)
+        config = self._guilds.get(guild_id)
+        if config is not None:
+            config[key] = value
+        return result
+
+    async def delete(self, guild_id, key):
+        table = self.dbi.table('guild_config')
+        query = table.query.where(guild_id=guild_id, config_name=key)
+        result = await query.delete()
+        config = self._guilds.get(guild_id)
+        if config is not None:
+            config.pop(key, None)
+        return result
+
+    def invalidate(self, guild_id=None):
+        """Drop cached settings for a guild, or for all guilds."""
+        if guild_id is None:
+            self._guilds.clear()
+        else:
+            self._guilds.pop(guild_id, None)
@@ -1,6 +1,33 @@
 from manibot.core.data_manager import schema
 from manibot.core.logger import LOGGERS
 
+# fills the message count rollup from the messages already stored
+MESSAGE_COUNTS_BACKFILL = (
+    "INSERT INTO message_counts (guild_id, author_id, day, messages) "
+    "SELECT guild_id, author_id, "
+    "(to_timestamp(sent) AT TIME ZONE 'UTC')::date AS day, count(*) "
+    "FROM discord_messages "
+    "WHERE is_edit = false AND guild_id IS NOT NULL "
+    "GROUP BY 1, 2, 3 "
+    "ON CONFLICT (guild_id, author_id, day) DO NOTHING;")
+
+# time-series tables split into monthly partitions on a unix time column,
+# with the number of column units per second
+PARTITIONED_TABLES = {
+    'discord_messages' : ('sent', 1),
+    'member_activity'  : ('time', 1000),
+}
+
+# primary key of a table, to tell which version of it an install has
+PRIMARY_KEY_SQL = (
+    "SELECT pg_get_constraintdef(oid) AS definition "
+    "FROM pg_catalog.pg_constraint "
+    "WHERE conrelid = to_regclass($1) AND contype = 'p';")
+
+# member_activity times below this are unix seconds from before it moved
+# to milliseconds, as milliseconds only got this small in 1973
+SECONDS_BEFORE = 100000000000
+
 def core_table_sqls():
     sql_dict = {
         'guild_config' : ("CREATE TABLE guild_config ("
@@ -39,17 +66,20 @@ def core_table_sqls():
                               "webhook_id bigint, "
                               "attachments text[], "
                               "CONSTRAINT discord_messages_pkey "
-                              "PRIMARY KEY (message_id, sent));"),
+                              "PRIMARY KEY (message_id, sent)) "
+                              "PARTITION BY RANGE (sent);"),
 
         'member_activity'  : ("CREATE TABLE member_activity ("
                               "member_id bigint NOT NULL, "
+                              # unix time in milliseconds
                               "time bigint NOT NULL, "
                               "status text, "
                               "from_status text, "
-                              "guild_id bigint, "
+                              "guild_id bigint NOT NULL, "
                               "display_name text, "
                               "CONSTRAINT member_activity_pkey "
-                              "PRIMARY KEY (member_id, time));"),
+                              "PRIMARY KEY (guild_id, member_id, time)) "
+                              "PARTITION BY RANGE (time);"),
 
         'command_log'      : ("CREATE TABLE command_log ("
                               "message_id bigint NOT NULL, "
@@ -65,7 +95,15 @@ def core_table_sqls():
                               "command_failed bool NOT NULL DEFAULT FALSE, "
                               "cog text, "
                               "CONSTRAINT command_log_pkey "
-                              "PRIMARY KEY (message_id, sent));")
+                              "PRIMARY KEY (message_id, sent));"),
+
+        'message_counts'   : ("CREATE TABLE message_counts ("
+                              "guild_id bigint NOT NULL, "
+                              "author_id bigint NOT NULL, "
+                              "day date NOT NULL, "
+                              "messages int NOT NULL DEFAULT 0, "
+                              "CONSTRAINT message_counts_pkey "
+                              "PRIMARY KEY (guild_id, author_id, day));")
     }
 
     log_sql = ("CREATE TABLE {log_table} ("
@@ -88,6 +126,20 @@ def core_table_sqls():
     return sql_dict
 
 
+def core_indexes():
+    index_dict = {
+        # msgcount and mostactive filter by guild and author on originals
+        'discord_messages' : [schema.Index(
+            'guild_id', 'author_id', 'sent', where='is_edit = false')],
+        'command_log'      : [schema.Index('guild_id')],
+    }
+    for log in LOGGERS:
+        # last_exception pages errors newest first
+        index_dict[log] = [schema.Index('level_name', 'created', 'log_id')]
+
+    return index_dict
+
+
 class CogTable:
     table_config = {
         "name" : "base_default_table",
@@ -0,0 +1,204 @@
+import asyncio
+import logging
+
+import asyncpg
+
+from .errors import SchemaError
+
+
+class BatchWriter:
+    """Buffers rows for a table in memory and writes them in bulk.
+
+    Rows are sent with a single ``COPY`` once ``max_rows`` are waiting or
+    ``max_delay`` seconds have passed. No more than ``max_pending`` rows
+    are held at once, after which :meth:`put` waits for the database to
+    catch up.
+
+    Parameters
+    -----------
+    dbi: :class:`DatabaseInterface`
+        The interface used to write to the database.
+    table: :class:`str`
+        Name of the table rows are written to.
+    columns: :class:`tuple`
+        Column names, in the order rows are written.
+    max_rows: :class:`int`
+        Number of rows that triggers an immediate flush.
+    max_delay: :class:`float`
+        Seconds to wait before flushing a partial batch.
+    max_pending: :class:`int`
+        Maximum rows buffered or in flight before :meth:`put` blocks.
+    primaries: :class:`tuple`
+        Primary key columns. If given, a batch that hits a duplicate key
+        is retried as an insert that skips the conflicting rows.
+    on_write: coroutine function
+        Called with the connection and each batch of rows, in the
+        transaction that writes them. Rows skipped as duplicates aren't
+        included. If it raises, the batch isn't written either.
+    """
+
+    def __init__(self, dbi, table, columns, *, max_rows=500, max_delay=1.0,
+                 max_pending=10000, primaries=None, on_write=None):
+        self.dbi = dbi
+        self.table = str(table)
+        self.columns = tuple(columns)
+        self.max_rows = max_rows
+        self.max_delay = max_delay
+        self.max_pending = max_pending
+        self.primaries = primaries
+        self.on_write = on_write
+        self.logger = logging.getLogger('manibot.core.dbi.BatchWriter')
+        self._buffer = []
+        self._in_flight = 0
+        self._task = None
+        self._closed = False
+        self._backing_off = False
+        self._lock = asyncio.Lock()
+        self._flush_now = asyncio.Event()
+        self._has_space = asyncio.Event()
+        self._has_space.set()
+
+    def __len__(self):
+        return len(self._buffer) + self._in_flight
+
+    @property
+    def running(self):
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        if self._closed or self.running:
+            return False
+        self._task = asyncio.ensure_future(self._run(), loop=self.dbi.loop)
+        return True
+
+    async def put(self, **data):
+        """Add a row to the buffer, waiting if it's full."""
+        unknown = data.keys() - set(self.columns)
+        if unknown:
+            raise SchemaError(
+                f"Unknown columns for {self.table}: {', '.join(unknown)}")
+        row = tuple(data.get(c) for c in self.columns)
+        while len(self) >= self.max_pending:
+            self._has_space.clear()
+            await self._has_space.wait()
+        self._buffer.append(row)
+        if len(self._buffer) >= self.max_rows and not self._backing_off:
+            self._flush_now.set()
+        self.start()
+
+    async def _run(self):
+        delay = self.max_delay
+        while not self._closed:
+            try:
+                await asyncio.wait_for(self._flush_now.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+            self._backing_off = not await self.flush()
+            if self._backing_off:
+                # full batches won't trigger a flush until the breaker
+                # is due to let a call through again
+                delay = max(self.max_delay, self.dbi.breaker.retry_in)
+            else:
+                delay = self.max_delay
+
+    async def flush(self):
+        """Write all buffered rows to the database.
+
+        Returns ``False`` if the database was unreachable, leaving the
+        remaining rows buffered.
+        """
+        async with self._lock:
+            while self._buffer:
+                rows = self._buffer[:self.max_rows]
+                del self._buffer[:self.max_rows]
+                if len(self._buffer) < self.max_rows:
+                    self._flush_now.clear()
+                self._in_flight = len(rows)
+                try:
+                    await self._write(rows)
+                except (asyncpg.PostgresError, OSError) as e:
+                    if self.dbi.breaker.failures:
+                        # database is unreachable, retry on the next flush
+                        self._buffer[:0] = rows
+                        self._flush_now.clear()
+                        return False
+                    self.logger.exception(
+                        f'Dropped {len(rows)} rows for {self.table}: '
+                        f'{type(e).__name__}', exc_info=e)
+                except Exception as e:
+                    # values that fail to encode are raised client side as
+                    # DataError or InterfaceError, so only drop this batch
+                    # and keep the writer running for the rest
+                    self.logger.exception(
+                        f'Dropped {len(rows)} bad rows for {self.table}: '
+                        f'{type(e).__name__}', exc_info=e)
+                finally:
+                    self._in_flight = 0
+                    self._has_space.set()
+        return True
+
+    async def _write(self, rows):
+        """Write rows, returning those that were actually stored.
+
+        The ``on_write`` hook runs in the same transaction, so its changes
+        are only kept along with the rows.
+        """
+        async def copy(conn):
+            await conn.copy_records_to_table(
+                self.table, records=rows, columns=self.columns)
+            await self._after_write(conn, rows)
+            return rows
+
+        statement = f"COPY {self.table} ({', '.join(self.columns)})"
+        try:
+            return await self.dbi.execute_in_transaction(
+                copy, statement=statement)
+        except asyncpg.UniqueViolationError:
+            if not self.primaries:
+                raise
+        insert = self.dbi.table(self.table).insert(*self.columns)
+        insert.primaries(*self.primaries)
+        insert.returning(*self.primaries)
+        insert.rows(rows)
+        statements = insert.statements(do_update=False)
+
+        async def insert_rows(conn):
+            rcrds = []
+            for query, args in statements:
+                rcrds.extend(await conn.fetch(query, *args))
+            written = self._stored_rows(rows, rcrds)
+            await self._after_write(conn, written)
+            return written
+
+        return await self.dbi.execute_in_transaction(
+            insert_rows, statement=statements[0][0])
+
+    def _stored_rows(self, rows, rcrds):
+        # match returned keys back to rows, once each, so repeats of a
+        # row within the batch aren't passed on twice either
+        stored = {tuple(r[c] for c in self.primaries) for r in rcrds}
+        key_idx = [self.columns.index(c) for c in self.primaries]
+        written = []
+        for row in rows:
+            key = tuple(row[i] for i in key_idx)
+            if key in stored:
+                stored.discard(key)
+                written.append(row)
+        return written
+
+    async def _after_write(self, conn, rows):
+        if self.on_write and rows:
+            await self.on_write(conn, rows)
+
+    async def stop(self):
+        """Stop the background flush and write any remaining rows."""
+        self._closed = True
+        self._flush_now.set()
+        if self._task:
+            await self._task
+            self._task = None
+        if not await self.flush():
+            self.logger.error(
+                f'Dropped {len(self._buffer)} rows for {self.table} on '
+                f'shutdown, the database is unavailable.')
+            self._buffer.clear()
@@ -1,10 +1,11 @@
 import asyncio
+import collections
 import json
 import os
 import sys
 import time
 import traceback
-from datetime import timezone
+from datetime import datetime, timezone
 
 import logging
 from logging import handlers
@@ -13,11 +14,27 @@ import asyncpg
 import discord
 
 from manibot.utils import snowflake
+from manibot.utils.formatters import convert_to_bool
 
 get_id = snowflake.create()
 
 LOGGERS = ('bot_logs', 'discord_logs')
 
+MESSAGE_COLUMNS = (
+    'message_id', 'sent', 'is_edit', 'deleted', 'author_id', 'channel_id',
+    'guild_id', 'content', 'clean_content', 'embeds', 'webhook_id',
+    'attachments')
+
+ACTIVITY_COLUMNS = (
+    'member_id', 'time', 'status', 'from_status', 'guild_id', 'display_name')
+
+# adds to the daily message count rollup
+MESSAGE_COUNT_SQL = (
+    "INSERT INTO message_counts (guild_id, author_id, day, messages) "
+    "VALUES ($1, $2, $3, $4) "
+    "ON CONFLICT (guild_id, author_id, day) "
+    "DO UPDATE SET messages = message_counts.messages + EXCLUDED.messages;")
+
 module_logger = logging.getLogger('manibot.core.logger')
 
 
@@ -78,49 +95,219 @@ def init_logger(bot, debug_flag=False):
     bot_log.addHandler(bot_db)
     discord_db = DBLogHandler(bot, 'discord_logs')
     discord_log.addHandler(discord_db)
+    for handler in (bot_db, discord_db):
+        handler.start()
+        bot.db_flushers.append(handler)
 
-    bot.add_cog(ActivityLogging(bot))
+    activity = ActivityLogging(bot)
+    activity.presence.start()
+    bot.db_flushers.append(activity.presence)
+    bot.add_cog(activity)
 
     return bot_log
 
 
 class DBLogHandler(logging.Handler):
-    def __init__(self, bot, log_name: str, level=logging.INFO):
+    """Logging handler that stores records in a database log table.
+
+    :meth:`emit` only adds the record to an in-memory queue, so logging
+    never waits on the database. A single consumer task on the bot loop
+    drains the queue and writes each batch with one ``COPY``.
+
+    Once ``shed_at`` records are waiting, records below ``shed_level``
+    are dropped. When ``max_queue`` records are waiting, all new records
+    are dropped. Dropped records are counted by level name in
+    ``dropped``. While the database is unreachable records stay queued,
+    so an outage is bounded by the queue rather than retried per record.
+    """
+
+    COLUMNS = ('log_id', 'created', 'logger_name', 'level_name',
+               'file_path', 'module', 'func_name', 'line_no', 'message',
+               'traceback')
+
+    def __init__(self, bot, log_name: str, level=logging.INFO, *,
+                 max_queue=5000, shed_at=1000, shed_level=logging.WARNING,
+                 batch_size=500, interval=1.0):
         if log_name not in LOGGERS:
             raise RuntimeError(f'Unknown Log Name: {log_name}')
         self.bot = bot
         self.log_name = log_name
         self.logger = module_logger.getChild('DBLogHandler')
+        self.max_queue = max_queue
+        self.shed_at = shed_at
+        self.shed_level = shed_level
+        self.batch_size = batch_size
+        self.interval = interval
+        self.queue = collections.deque()
+        self.dropped = collections.Counter()
+        self._closing = asyncio.Event()
+        self._task = None
         super().__init__(level=level)
 
     def emit(self, record):
-        record_id = next(get_id)
-        asyncio.run_coroutine_threadsafe(
-            self.submit_log(record_id, record), self.bot.loop)
-
-    async def submit_log(self, log_id, record):
-        data = dict(log_id=log_id, created=record.created,
-                    logger_name=str(record.name),
-                    level_name=str(record.levelname),
-                    file_path=str(record.pathname),
-                    module=str(record.module),
-                    func_name=str(record.funcName),
-                    line_no=record.lineno,
-                    message=str(record.message),
-                    traceback=''.join(
-                        traceback.format_exception(*record.exc_info)))
-        try:
-            table = self.bot.dbi.table(self.log_name)
-            table.insert(**data)
-            await table.insert.commit()
-        except asyncpg.PostgresError as e:
-            self.logger.exception(type(e).__name__, exc_info=e)
+        size = len(self.queue)
+        if size >= self.max_queue or (
+                size >= self.shed_at and record.levelno < self.shed_level):
+            self.dropped[record.levelname] += 1
+            return
+        if record.exc_info:
+            tb = ''.join(traceback.format_exception(*record.exc_info))
+        else:
+            tb = None
+        self.queue.append((
+            next(get_id), int(record.created), str(record.name),
+            str(record.levelname), str(record.pathname), str(record.module),
+            str(record.funcName), record.lineno, record.getMessage(), tb))
+
+    def start(self):
+        if self._task:
+            return False
+        self._task = self.bot.loop.create_task(self.consume())
+        return True
+
+    async def consume(self):
+        while not self._closing.is_set():
+            try:
+                await asyncio.wait_for(self._closing.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            await self.flush()
+
+    async def flush(self):
+        """Write all queued records to the database."""
+        while self.queue:
+            count = min(self.batch_size, len(self.queue))
+            batch = [self.queue.popleft() for __ in range(count)]
+            try:
+                await self.bot.dbi.execute_copy(
+                    self.log_name, batch, self.COLUMNS)
+            except asyncpg.PostgresError as e:
+                if self.bot.dbi.breaker.failures:
+                    # database is unreachable, keep the batch for later
+                    self.queue.extendleft(reversed(batch))
+                    return
+                self.dropped['FAILED'] += len(batch)
+                self.logger.exception(type(e).__name__, exc_info=e)
+                return
+
+    async def stop(self):
+        """Stop the consumer task and write any remaining records."""
+        self._closing.set()
+        if self._task:
+            await self._task
+            self._task = None
+        await self.flush()
+
+
+class PresenceBuffer:
+    """Coalesces member status and nickname changes before storing them.
+
+    Changes are held per guild member for ``window`` seconds, keeping the
+    latest state along with the status the member had when the window
+    opened. A burst of presence updates becomes at most one row per
+    member per window, and a status that flips back before the window
+    ends isn't stored at all. Rows are then written in bulk by
+    ``writer``.
+
+    Times are unix milliseconds, so changes in the same second no longer
+    collide on the ``(guild_id, member_id, time)`` primary key.
+    """
+
+    def __init__(self, writer, *, window=5.0):
+        self.writer = writer
+        self.window = window
+        self.logger = module_logger.getChild('PresenceBuffer')
+        self.pending = {}
+        self._closing = asyncio.Event()
+        self._task = None
+
+    def add(self, guild_id, member_id, *, status=None, from_status=None,
+            display_name=None):
+        entry = self.pending.get((guild_id, member_id))
+        if entry is None:
+            entry = self.pending[(guild_id, member_id)] = dict(
+                member_id=member_id, guild_id=guild_id, status=None,
+                from_status=None, display_name=None)
+        entry['time'] = int(time.time() * 1000)
+        if status:
+            if entry['from_status'] is None:
+                entry['from_status'] = from_status
+            entry['status'] = status
+        if display_name:
+            entry['display_name'] = display_name
+
+    def start(self):
+        if self._task:
+            return False
+        self._task = asyncio.ensure_future(
+            self.consume(), loop=self.writer.dbi.loop)
+        return True
+
+    async def consume(self):
+        while not self._closing.is_set():
+            try:
+                await asyncio.wait_for(self._closing.wait(), self.window)
+            except asyncio.TimeoutError:
+                pass
+            await self.flush()
+
+    async def flush(self):
+        """Pass the coalesced changes on to the writer."""
+        pending, self.pending = self.pending, {}
+        for data in pending.values():
+            if data['status'] == data['from_status']:
+                if not data['display_name']:
+                    continue
+                # status flipped back, so only the nickname changed
+                data['status'] = data['from_status'] = None
+            await self.writer.put(**data)
+
+    async def stop(self):
+        """Stop the flush task and pass on any remaining changes."""
+        self._closing.set()
+        if self._task:
+            await self._task
+            self._task = None
+        await self.flush()
 
 
 class ActivityLogging:
     def __init__(self, bot):
         self.bot = bot
         self.logger = module_logger.getChild('ActivityLogging')
+        self.message_writer = bot.dbi.batch_writer(
+            'discord_messages', MESSAGE_COLUMNS,
+            primaries=('message_id', 'sent'), on_write=self.count_messages)
+        self.presence = PresenceBuffer(bot.dbi.batch_writer(
+            'member_activity', ACTIVITY_COLUMNS,
+            primaries=('guild_id', 'member_id', 'time')))
+
+    async def presence_enabled(self, guild_id):
+        """Whether member activity is logged for a guild.
+
+        On unless turned off with the ``PresenceLogging`` guild setting,
+        for guilds where presence churn isn't worth storing.
+        """
+        value = await self.bot.dbi.settings.get(guild_id, 'PresenceLogging')
+        return value is None or convert_to_bool(value) is not False
+
+    async def count_messages(self, conn, rows):
+        """Add a batch of messages to the daily count rollup.
+
+        Runs in the transaction that writes the messages, so the counts
+        are kept or lost along with them.
+        """
+        counts = collections.Counter()
+        for row in rows:
+            data = dict(zip(MESSAGE_COLUMNS, row))
+            if data['is_edit'] or data['guild_id'] is None:
+                continue
+            day = datetime.utcfromtimestamp(data['sent']).date()
+            counts[(data['guild_id'], data['author_id'], day)] += 1
+        if counts:
+            # sorted so concurrent upserts lock rows in the same order
+            args = [(*key, count) for key, count in sorted(counts.items())]
+            await conn.executemany(MESSAGE_COUNT_SQL, args)
 
     async def on_message(self, msg):
         sent = int(msg.created_at.replace(tzinfo=timezone.utc).timestamp())
@@ -132,30 +319,26 @@ class ActivityLogging:
                     guild_id=guild_id, content=msg.content,
                     clean_content=msg.clean_content, embeds=embeds,
                     webhook_id=msg.webhook_id, attachments=attachments)
-        try:
-            table = self.bot.dbi.table('discord_messages')
-            table.insert(**data)
-            await table.insert.commit()
-        except asyncpg.PostgresError as e:
-            self.logger.exception(type(e).__name__, exc_info=e)
+        await self.message_writer.put(**data)
 
     async def on_raw_message_delete(self, payload):
+        # deleted message may still be waiting to be written
+        await self.message_writer.flush()
         try:
             table = self.bot.dbi.table('discord_messages')
-            table.update(deleted=True)
-            table.update.where(message_id=payload.message_id)
-            await table.update.commit()
+            update = table.update(deleted=True)
+            update.where(message_id=payload.message_id)
+            await update.commit()
         except asyncpg.PostgresError as e:
             self.logger.exception(type(e).__name__, exc_info=e)
 
     async def on_raw_bulk_message_delete(self, payload):
+        await self.message_writer.flush()
         try:
             table = self.bot.dbi.table('discord_messages')
-            table.update(deleted=True)
-            m_ids = payload.message_ids
-            conditions = [table['message_id'] == m_id for m_id in m_ids]
-            table.update.where(conditions)
-            await table.update.commit()
+            update = table.update(deleted=True)
+            update.where(table['message_id'].in_(payload.message_ids))
+            await update.commit()
         except asyncpg.PostgresError as e:
             self.logger.exception(type(e).__name__, exc_info=e)
 
@@ -176,10 +359,10 @@ class ActivityLogging:
                     webhook_id=msg.webhook_id, attachments=attachments)
         try:
             table = self.bot.dbi.table('discord_messages')
-            table.insert(**data)
+            insert = table.insert(**data)
             # update existing data
-            table.insert.primaries('message_id', 'sent')
-            await table.insert.commit(do_update=True)
+            insert.primaries('message_id', 'sent')
+            await insert.commit(do_update=True)
         except asyncpg.PostgresError as e:
             self.logger.exception(type(e).__name__, exc_info=e)
 
@@ -199,10 +382,10 @@ class ActivityLogging:
                     command_failed=ctx.command_failed, cog=cog)
         try:
             table = self.bot.dbi.table('command_log')
-            table.insert(**data)
-            table.insert.primaries('message_id', 'sent')
+            insert = table.insert(**data)
+            insert.primaries('message_id', 'sent')
             # ignore conflicts
-            await table.insert.commit(do_update=False)
+            await insert.commit(do_update=False)
         except asyncpg.PostgresError as e:
             self.logger.exception(type(e).__name__, exc_info=e)
 
@@ -221,18 +404,13 @@ class ActivityLogging:
         if not status_update and not name_update:
             return
 
-        time_value = int(time.time())
         guild = after.guild.id if after.guild else None
-
-        data = dict(member_id=after.id, time=time_value,
-                    status=status_update, from_status=status_from,
-                    guild_id=guild, display_name=name_update)
-
         try:
-            table = self.bot.dbi.table('member_activity')
-            table.insert(**data)
-            table.insert.primaries('member_id', 'time')
-            # ignore conflicts
-            await table.insert.commit(do_update=False)
+            if guild and not await self.presence_enabled(guild):
+                return
         except asyncpg.PostgresError as e:
-            self.logger.exception(type(e).__name__, exc_info=e)
+            return self.logger.exception(type(e).__name__, exc_info=e)
+
+        self.presence.add(
+            guild, after.id, status=status_update, from_status=status_from,
+            display_name=name_update)
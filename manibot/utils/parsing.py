@@ -0,0 +1,127 @@
+"""Feed and HTML parsing that runs off the event loop.
+
+The parse functions are plain module level functions so they can be
+pickled over to a worker process. Each returns only the small pieces of
+data the bot needs, never the parsed document itself.
+"""
+
+import asyncio
+import functools
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import bs4
+import feedparser
+
+FEED_ENTRY_FIELDS = ('id', 'title', 'link', 'author', 'summary', 'updated')
+
+logger = logging.getLogger('manibot.utils.parsing')
+
+
+def parse_feed(text):
+    """Returns the entries of a feed as plain dicts."""
+    entries = feedparser.parse(text).entries
+    return [{k: entry.get(k) for k in FEED_ENTRY_FIELDS} for entry in entries]
+
+
+def og_image(html):
+    """Returns the ``og:image`` url of a page, if any."""
+    soup = bs4.BeautifulSoup(html, 'html.parser')
+    image = soup.find("meta", property="og:image")
+    return image["content"] if image else None
+
+
+def first_page_image(html):
+    """Returns the ``data-src`` of the first image of a chapter page.
+
+    Returns ``False`` if the page has no images yet.
+    """
+    soup = bs4.BeautifulSoup(html, 'html.parser')
+    allimgs = soup.find("div", {"id": "all"})
+    if not allimgs:
+        return False
+    firstimg = allimgs.find("img")
+    if not firstimg:
+        return False
+    return firstimg['data-src']
+
+
+def series_page(html):
+    """Returns the details listed on a series page.
+
+    The result has the series ``title``, the ``details`` from the page's
+    ``dt``/``dd`` table and ``chapters`` as ``(name, url)`` tuples, newest
+    first. Categories and Tags details are lists of their items.
+    """
+    soup = bs4.BeautifulSoup(html, 'html.parser')
+    title = soup.find_all('h2', class_='widget-title')[0].get_text()
+    table_values = soup.find_all('dd')
+    table_titles = soup.find_all('dt')
+    table = dict(
+        zip([t.get_text(strip=True) for t in table_titles], table_values))
+
+    details = {}
+    for k, v in table.items():
+        if k in ['Categories', 'Tags']:
+            details[k] = [str(i.string) for i in v if '\n' not in i.string]
+        else:
+            details[k] = v.get_text(strip=True)
+
+    chapter_data = soup.find_all('h5', class_='chapter-title-rtl')
+    chapters = [(i.a.get_text(), i.a['href']) for i in chapter_data]
+    return {'title': title, 'details': details, 'chapters': chapters}
+
+
+class ParseExecutor:
+    """Runs parse functions in a process pool.
+
+    Falls back to a thread pool if worker processes can't be started or
+    the pool breaks, which still keeps parsing off the event loop.
+
+    Parameters
+    -----------
+    loop: :class:`asyncio.AbstractEventLoop`
+        The loop the results are awaited on.
+    max_workers: :class:`int`
+        Number of workers. Defaults to half the CPUs, at least one.
+    processes: :class:`bool`
+        Use worker processes. ``False`` uses threads only.
+    """
+
+    def __init__(self, *, loop=None, max_workers=None, processes=True):
+        self.loop = loop or asyncio.get_event_loop()
+        self.max_workers = max_workers or max(1, (os.cpu_count() or 2) // 2)
+        self.executor = None
+        if processes:
+            try:
+                self.executor = ProcessPoolExecutor(self.max_workers)
+            except (OSError, NotImplementedError, ImportError) as e:
+                logger.warning(
+                    f'Process pool unavailable, using threads: {e!r}')
+        if self.executor is None:
+            self._use_threads()
+
+    @property
+    def uses_processes(self):
+        return isinstance(self.executor, ProcessPoolExecutor)
+
+    def _use_threads(self):
+        self.executor = ThreadPoolExecutor(self.max_workers)
+
+    async def run(self, func, *args, **kwargs):
+        """Run ``func`` with the given arguments in a worker."""
+        call = functools.partial(func, *args, **kwargs)
+        try:
+            return await self.loop.run_in_executor(self.executor, call)
+        except BrokenProcessPool:
+            # a worker died, likely killed for memory, so stop forking
+            logger.error('Process pool broke, falling back to threads')
+            if self.uses_processes:
+                self.executor.shutdown(wait=False)
+                self._use_threads()
+            return await self.loop.run_in_executor(self.executor, call)
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)